@@ -2,4 +2,4 @@ from flask import Blueprint
 
 api = Blueprint('api', __name__)
 
-from . import products, skus, offers, errors
\ No newline at end of file
+from . import products, skus, offers, prices, errors
\ No newline at end of file
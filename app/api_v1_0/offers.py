@@ -3,6 +3,7 @@ from . import api
 from .. import db
 from ..models import Offer, SKU
 from ..exceptions import ValidationError
+from .pagination import CursorPagination
 
 
 @api.route('/offer/<int:pk>/', methods=['GET'])
@@ -11,33 +12,33 @@ def get_offer(pk):
     return jsonify(offer.to_json())
 
 
+def filter_offers(query):
+    """
+    Narrows offers query by request arguments: ?active=1 (or 0) and
+    ?segmentation=..., both served by the (segmentation, is_active) index
+    :return: filtered query and arguments to keep in links
+    """
+    filters = {}
+    active = request.args.get('active', type=int)
+    if active is not None:
+        query = query.filter(Offer.is_active == bool(active))
+        filters['active'] = active
+    segmentation = request.args.get('segmentation')
+    if segmentation:
+        query = query.filter(Offer.segmentation == segmentation)
+        filters['segmentation'] = segmentation
+    return query, filters
+
+
 @api.route('/offers/', methods=['GET'])
 def get_offers():
-    page = request.args.get('page', 1, type=int)
-    per_page = 20
-    offers = Offer.query.paginate(page, per_page)
-    meta = {
-        'page': page,
-        'total_pages': offers.pages,
-        'per_page': per_page,
-        'total_items': offers.total
-    }
-    if offers.has_prev:
-        meta['previous'] = url_for(request.endpoint,
-                                   page=offers.prev_num, _external=True)
-    else:
-        meta['previous'] = None
-    if offers.has_next:
-        meta['next'] = url_for(request.endpoint,
-                               page=offers.next_num, _external=True)
-    else:
-        meta['next'] = None
-    meta['first'] = url_for(request.endpoint, page=1, _external=True)
-    meta['last'] = url_for(request.endpoint, page=offers.pages, _external=True)
+    query, filters = filter_offers(Offer.query)
+    pagination = CursorPagination(query, Offer.id, **filters)
+    offers = pagination.query.all()
     return jsonify(
         {
-            'offers': [offer.to_json() for offer in offers.items],
-            'meta': meta
+            'offers': [offer.to_json() for offer in offers],
+            'meta': pagination.meta([offer.id for offer in offers])
         }
     )
 
@@ -47,7 +48,8 @@ def get_offers_for_sku(stock_code):
     sku = SKU.query.filter_by(stock_code=stock_code).first()
     if not sku:
         abort(404)
-    offers = Offer.query.filter_by(sku=sku).order_by(Offer.id)
+    offers, _ = filter_offers(Offer.query.filter_by(sku=sku))
+    offers = offers.order_by(Offer.id)
     return jsonify({'offers': [offer.to_json() for offer in offers]})
 
 
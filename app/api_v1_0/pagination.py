@@ -0,0 +1,126 @@
+import base64
+import json
+
+from flask import current_app, request, url_for
+from .. import db
+from ..exceptions import ValidationError
+
+
+def encode_cursor(position):
+    return base64.urlsafe_b64encode(
+        json.dumps(position, sort_keys=True).encode('utf-8')
+    ).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        position = json.loads(
+            base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    except (TypeError, ValueError):
+        raise ValidationError('invalid cursor')
+    if not isinstance(position, dict) or \
+            not set(position) <= {'after', 'before', 'page'} or \
+            not all(value is None or type(value) is int
+                    for value in position.values()):
+        raise ValidationError('invalid cursor')
+    # a position is the id right next to the page (before: null is the
+    # end of the rows); pages by number are only served for legacy ?page=
+    if len(set(position) & {'after', 'before'}) != 1 or \
+            position.get('after', 0) is None:
+        raise ValidationError('invalid cursor')
+    return position
+
+
+class CursorPagination:
+    """
+    Keyset pagination of a query by primary key: a page is the rows right
+    after (or before) the id held by an opaque ?cursor=, so deep pages
+    cost the same as the first one. ?per_page= is capped at
+    API_MAX_PER_PAGE. Counting all rows is up to the client, with
+    ?with_total=1.
+
+    Legacy ?page= links are still served, with an OFFSET.
+    """
+    def __init__(self, query, column, **link_args):
+        """
+        :param column: primary key column of the query's rows
+        :param link_args: arguments kept in links to other pages,
+        e.g. filters
+        """
+        config = current_app.config
+        self.base_query = query
+        self.column = column
+        self.per_page = max(1, min(
+            request.args.get('per_page', config['API_PER_PAGE'], type=int),
+            config['API_MAX_PER_PAGE']
+        ))
+        self.with_total = bool(request.args.get('with_total', 0, type=int))
+        self.link_args = dict(link_args, per_page=self.per_page)
+        if self.with_total:
+            self.link_args['with_total'] = 1
+        cursor = request.args.get('cursor')
+        if cursor:
+            self.position = decode_cursor(cursor)
+        else:
+            self.position = {'page': request.args.get('page', 1, type=int)}
+        self.page = self.position.get('page')
+        self.query = self._page_query()
+
+    def _page_query(self):
+        """:return: query of page's rows in ascending order"""
+        query = self.base_query.order_by(self.column)
+        if 'after' in self.position:
+            return query.filter(self.column > self.position['after']) \
+                .limit(self.per_page)
+        if 'before' in self.position:
+            # the rows closest to `before`, put back in ascending order
+            preceding = self.base_query.with_entities(self.column)
+            if self.position['before'] is not None:
+                preceding = preceding.filter(
+                    self.column < self.position['before'])
+            preceding = preceding.order_by(self.column.desc()) \
+                .limit(self.per_page)
+            return query.filter(self.column.in_(preceding.subquery()))
+        return query.offset((max(self.page, 1) - 1) * self.per_page) \
+            .limit(self.per_page)
+
+    def _exists(self, criterion):
+        return db.session.query(
+            self.base_query.filter(criterion).exists()).scalar()
+
+    def _link(self, position):
+        args = dict(self.link_args)
+        if position is not None:
+            args['cursor'] = encode_cursor(position)
+        return url_for(request.endpoint, _external=True, **args)
+
+    def meta(self, ids):
+        """
+        :param ids: ids of page's rows, as ordered by self.query
+        :return: meta of the page, with links to its neighbours
+        """
+        total_items = total_pages = None
+        if self.with_total:
+            total_items = self.base_query.order_by(None).count()
+            total_pages = -(-total_items // self.per_page)
+        page = self.page
+        meta = {
+            'page': page,
+            'per_page': self.per_page,
+            'total_items': total_items,
+            'total_pages': total_pages,
+            'next': None,
+            'previous': None,
+            'first': self._link(None),
+        }
+        # the rows before the end
+        meta['last'] = self._link({'before': None, 'page': total_pages})
+        if ids and self._exists(self.column > ids[-1]):
+            meta['next'] = self._link({
+                'after': ids[-1], 'page': page + 1 if page else None
+            })
+        if ids and self._exists(self.column < ids[0]):
+            meta['previous'] = self._link({
+                'before': ids[0], 'page': page - 1 if page else None
+            })
+        return meta
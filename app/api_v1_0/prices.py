@@ -0,0 +1,47 @@
+import datetime
+
+from flask import jsonify, request, abort
+from . import api
+from ..models import Offer, PriceChange, SKU
+from ..exceptions import ValidationError
+
+TIME_FORMATS = ('%Y-%m-%dT%H:%M:%S', '%Y-%m-%d')
+
+
+def time_arg(name):
+    """:return: datetime given as ?name=2015-03-01 or 2015-03-01T12:00:00"""
+    value = request.args.get(name)
+    if not value:
+        return None
+    for time_format in TIME_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, time_format)
+        except ValueError:
+            pass
+    raise ValidationError('%s must be a date, e.g. 2015-03-01 or '
+                          '2015-03-01T12:00:00' % name)
+
+
+def price_series():
+    """Price history between ?since= and ?until=, see PriceChange.series"""
+    return PriceChange.series(since=time_arg('since'),
+                              until=time_arg('until'))
+
+
+@api.route('/offer/<int:pk>/prices/', methods=['GET'])
+def get_offer_prices(pk):
+    prices = price_series().filter(PriceChange.offer_id == pk).all()
+    if not prices:
+        Offer.query.get_or_404(pk)
+    return jsonify({'prices': [price.to_json() for price in prices]})
+
+
+@api.route('/sku/<stock_code>/prices/', methods=['GET'])
+def get_sku_prices(stock_code):
+    prices = price_series() \
+        .join(Offer, Offer.id == PriceChange.offer_id) \
+        .join(SKU, SKU.id == Offer.sku_id) \
+        .filter(SKU.stock_code == stock_code).all()
+    if not prices and not SKU.query.filter_by(stock_code=stock_code).count():
+        abort(404)
+    return jsonify({'prices': [price.to_json() for price in prices]})
@@ -3,6 +3,7 @@ from . import api
 from .. import db
 from ..models import Product, is_allowed_product_type
 from ..exceptions import ValidationError
+from .pagination import CursorPagination
 
 
 @api.route("/product/<int:pk>/", methods=['GET'])
@@ -13,8 +14,15 @@ def get_product(pk):
 
 @api.route('/products/', methods=['GET'])
 def get_products():
-    products = Product.query.order_by(Product.id)
-    return jsonify({'products': [product.to_json() for product in products]})
+    pagination = CursorPagination(Product.query, Product.id)
+    products = pagination.query.all()
+    product_ids = [product.id for product in products]
+    stock_codes = Product.stock_codes(product_ids)
+    return jsonify({
+        'products': [product.to_json(stock_codes.get(product.id, []))
+                     for product in products],
+        'meta': pagination.meta(product_ids)
+    })
 
 
 @api.route('/products/', methods=['POST'])
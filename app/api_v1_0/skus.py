@@ -2,6 +2,7 @@ from flask import jsonify, request, url_for, abort
 from . import api
 from .. import db
 from ..models import SKU, Product, Photo
+from .pagination import CursorPagination
 
 
 @api.route('/sku/<stock_code>/', methods=['GET'])
@@ -14,15 +15,19 @@ def get_sku(stock_code):
 
 @api.route('/skus/', methods=['GET'])
 def get_skus():
-    skus = SKU.query.order_by(SKU.id)
-    return jsonify({'skus': [sku.to_json() for sku in skus]})
+    pagination = CursorPagination(SKU.query, SKU.id)
+    skus = SKU.query_to_json(pagination.query)
+    return jsonify({
+        'skus': skus,
+        'meta': pagination.meta([sku['id'] for sku in skus])
+    })
 
 
 @api.route('/product/<int:pk>/skus/', methods=['GET'])
 def get_skus_for_product(pk):
     product = Product.query.get_or_404(pk)
     skus = SKU.query.filter_by(base_product=product).order_by(SKU.id)
-    return jsonify({'skus': [sku.to_json() for sku in skus]})
+    return jsonify({'skus': SKU.query_to_json(skus)})
 
 
 @api.route('/product/<int:pk>/skus/', methods=['POST'])
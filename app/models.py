@@ -27,12 +27,36 @@ class Product(db.Model):
     manufacturer = db.Column(db.String(128), index=True)
     model_name = db.Column(db.String(255), index=True)
     product_type = db.Column(db.String(32))
+    colors_fingerprint = db.Column(db.String(16))
     skus = db.relationship('SKU', backref='base_product', lazy='dynamic')
 
     def get_full_product_name(self):
         return "%s %s" % (self.manufacturer, self.model_name)
 
-    def to_json(self):
+    @staticmethod
+    def stock_codes(product_ids=None):
+        """
+        Stock codes of skus of given products, or of all products, with
+        one query
+        :return: dict of lists of stock codes by product id
+        """
+        query = db.session.query(SKU.base_product_id, SKU.stock_code)
+        if product_ids is not None:
+            if not product_ids:
+                return {}
+            query = query.filter(SKU.base_product_id.in_(product_ids))
+        stock_codes = {}
+        for product_id, stock_code in query.order_by(SKU.id):
+            stock_codes.setdefault(product_id, []).append(stock_code)
+        return stock_codes
+
+    def to_json(self, stock_codes=None):
+        """
+        :param stock_codes: stock codes of product's skus, if already
+        loaded with Product.stock_codes
+        """
+        if stock_codes is None:
+            stock_codes = Product.stock_codes([self.id]).get(self.id, [])
         json_product = {
             'id': self.id,
             'url': url_for('api.get_product', pk=self.id, _external=True),
@@ -41,12 +65,12 @@ class Product(db.Model):
             'product_type': self.product_type,
             'skus': [
                 {
-                    s.stock_code: url_for(
-                        'api.get_sku', stock_code=s.stock_code, _external=True
+                    stock_code: url_for(
+                        'api.get_sku', stock_code=stock_code, _external=True
                     )
-                } for s in self.skus
+                } for stock_code in stock_codes
             ],
-            'sku_count': self.skus.count()
+            'sku_count': len(stock_codes)
         }
         return json_product
 
@@ -81,7 +105,15 @@ class SKU(db.Model):
     offers = db.relationship('Offer', backref='sku', lazy='dynamic')
     availability = db.Column(db.String(32))
 
-    def to_json(self):
+    def to_json(self, product=None, photos=None, offers=None):
+        """
+        Related rows already loaded, e.g. by SKU.query_to_json, may be
+        given instead of being loaded lazily
+        :param product: base product
+        :param photos: photos of sku
+        :param offers: offers of sku
+        """
+        product = product or self.base_product
         sku_json = {
             'id': self.id,
             'availability': self.availability,
@@ -89,24 +121,54 @@ class SKU(db.Model):
                            _external=True),
             'stock_code': self.stock_code,
             'product': {
-                self.base_product.get_full_product_name():
+                product.get_full_product_name():
                 url_for('api.get_product', pk=self.base_product_id,
                         _external=True)
             },
             'photos': [
                 {'default': photo.default, 'url': photo.url}
-                for photo in self.photos
+                for photo in (self.photos if photos is None else photos)
             ],
             'offers': [
                 {
                     offer.tariff_plan_code: url_for(
                         'api.get_offer', pk=offer.id, _external=True)
                 }
-                for offer in self.offers
+                for offer in (self.offers if offers is None else offers)
             ]
         }
         return sku_json
 
+    @staticmethod
+    def query_to_json(query):
+        """
+        Serializes skus of query, loading products, photos and offers of
+        all of them with one IN (SELECT ...) query each instead of lazily
+        for every sku
+        :return: list of sku JSON in query order
+        """
+        skus = query.all()
+        if not skus:
+            return []
+        sku_ids = query.with_entities(SKU.id).subquery()
+        products = {
+            product.id: product for product in Product.query.filter(
+                Product.id.in_(query.with_entities(SKU.base_product_id)
+                               .subquery()))
+        }
+        photos = {}
+        for photo in Photo.query.filter(Photo.sku_id.in_(sku_ids)) \
+                .order_by(Photo.id):
+            photos.setdefault(photo.sku_id, []).append(photo)
+        offers = {}
+        for offer in db.session.query(
+                Offer.id, Offer.sku_id, Offer.tariff_plan_code
+        ).filter(Offer.sku_id.in_(sku_ids)).order_by(Offer.id):
+            offers.setdefault(offer.sku_id, []).append(offer)
+        return [sku.to_json(products[sku.base_product_id],
+                            photos.get(sku.id, []), offers.get(sku.id, []))
+                for sku in skus]
+
     @staticmethod
     def from_json(json_sku):
         stock_code = json_sku.get('stock_code')
@@ -134,11 +196,15 @@ class Photo(db.Model):
 
 class Offer(db.Model):
     __tablename__ = 'offers'
+    __table_args__ = (
+        db.Index('ix_offers_segmentation_is_active',
+                 'segmentation', 'is_active'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     category = db.Column(db.String(32), index=True)
     segmentation = db.Column(db.String(64))
     market = db.Column(db.String(10))
-    sku_id = db.Column(db.Integer, db.ForeignKey('skus.id'))
+    sku_id = db.Column(db.Integer, db.ForeignKey('skus.id'), index=True)
     price = db.Column(db.Float)
     old_price = db.Column(db.Float)
     abo_price = db.Column(db.Float)
@@ -148,9 +214,12 @@ class Offer(db.Model):
     contract_condition_code = db.Column(db.String(3), index=True)
     priority = db.Column(db.Integer)
     scrapping_date = db.Column(db.DateTime())
+    fingerprint = db.Column(db.String(16))
+    is_active = db.Column(db.Boolean, default=True)
 
     def ping(self, date):
         self.scrapping_date = date
+        self.is_active = True
         db.session.add(self)
 
     def set_prices(self, scrapped_price):
@@ -209,6 +278,7 @@ class Offer(db.Model):
             'offer_nsi_code': self.offer_code,
             'tariff_plan_code': self.tariff_plan_code,
             'contract_condition': self.contract_condition_code,
+            'is_active': self.is_active,
             'product_page': self.offer_url,
             'sku': {
                 self.sku.stock_code:
@@ -244,4 +314,118 @@ class Offer(db.Model):
         return "%s; %s; %s; %s" % (
             self.sku.stock_code, self.offer_code,
             self.tariff_plan_code, self.contract_condition_code
-        )
\ No newline at end of file
+        )
+
+
+class PriceChange(db.Model):
+    """
+    Append-only price history: a row is added only when an offer's price
+    or abo price differs from its previous row
+    """
+    __tablename__ = 'price_history'
+    __table_args__ = (
+        db.Index('ix_price_history_offer_id_recorded_at',
+                 'offer_id', 'recorded_at'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    offer_id = db.Column(db.Integer, db.ForeignKey('offers.id'),
+                         nullable=False)
+    recorded_at = db.Column(db.DateTime(), nullable=False)
+    price = db.Column(db.Float)
+    abo_price = db.Column(db.Float)
+
+    @staticmethod
+    def record_changes(segmentation, scrapping_time, offer_info=None):
+        """
+        Adds a row for every offer of segmentation scrapped at
+        scrapping_time whose prices differ from its latest row, with one
+        INSERT ... SELECT
+        :param offer_info: only offers with the codes of this offer from
+        the offer list are recorded, e.g. by a crawl worker saving pages
+        of it
+        :return: number of added rows
+        """
+        history = PriceChange.__table__
+        offers = Offer.__table__
+        latest = history.alias('latest')
+        latest_time = db.select([db.func.max(history.c.recorded_at)]) \
+            .where(history.c.offer_id == offers.c.id).as_scalar()
+        unchanged = db.exists().where(db.and_(
+            latest.c.offer_id == offers.c.id,
+            latest.c.recorded_at == latest_time,
+            latest.c.price == offers.c.price,
+            latest.c.abo_price == offers.c.abo_price
+        ))
+        criteria = [offers.c.segmentation == segmentation,
+                    offers.c.scrapping_date == scrapping_time]
+        if offer_info is not None:
+            criteria += [
+                offers.c.offer_code == offer_info["offerNSICode"],
+                offers.c.tariff_plan_code == offer_info["tariffPlanCode"],
+                offers.c.contract_condition_code ==
+                offer_info["contractConditionCode"]
+            ]
+        changed = db.select([
+            offers.c.id, db.literal(scrapping_time, db.DateTime()),
+            offers.c.price, offers.c.abo_price
+        ]).where(db.and_(~unchanged, *criteria))
+        return db.session.execute(history.insert().from_select(
+            ['offer_id', 'recorded_at', 'price', 'abo_price'], changed
+        )).rowcount
+
+    @staticmethod
+    def first_rows(offers, recorded_at):
+        """
+        :param offers: offers added without being crawled, e.g. by
+        discovery, already flushed
+        :return: their first rows
+        """
+        return [PriceChange(offer_id=offer.id, recorded_at=recorded_at,
+                            price=offer.price, abo_price=offer.abo_price)
+                for offer in offers]
+
+    @staticmethod
+    def series(since=None, until=None):
+        """
+        :return: query of price rows recorded between since and until,
+        including the row of every offer still in effect at since
+        """
+        query = PriceChange.query
+        if since is not None:
+            previous = db.aliased(PriceChange)
+            in_effect = db.session.query(
+                db.func.max(previous.recorded_at)
+            ).filter(previous.offer_id == PriceChange.offer_id,
+                     previous.recorded_at <= since).correlate(PriceChange)
+            query = query.filter(PriceChange.recorded_at >= db.func.coalesce(
+                in_effect.as_scalar(), since))
+        if until is not None:
+            query = query.filter(PriceChange.recorded_at < until)
+        return query.order_by(PriceChange.offer_id, PriceChange.recorded_at)
+
+    def to_json(self):
+        return {
+            'recorded_at': self.recorded_at.isoformat(),
+            'product_price': self.price,
+            'monthly_price': self.abo_price,
+            'offer': url_for('api.get_offer', pk=self.offer_id,
+                             _external=True)
+        }
+
+
+class CrawlUnit(db.Model):
+    """One unit of crawl work on the queue shared by crawl workers"""
+    __tablename__ = 'crawl_units'
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(16))
+    segmentation = db.Column(db.String(64))
+    payload = db.Column(db.Text)
+    status = db.Column(db.String(16), index=True)
+    attempts = db.Column(db.Integer, default=0)
+    leased_by = db.Column(db.String(64))
+    lease_expires = db.Column(db.DateTime(), index=True)
+    created_at = db.Column(db.DateTime())
+    finished_at = db.Column(db.DateTime())
+
+    def __repr__(self):
+        return "%s; %s; %s" % (self.kind, self.segmentation, self.payload)
@@ -0,0 +1,100 @@
+"""
+dev_crawl equivalent runs against a crawler.replay server, e.g. with a
+cassette recorded by `manage.py record_cassette`:
+
+    python -m benchmarks.crawl --latency 0.05 --jitter 0.05 --errors 0.02 \
+        --concurrency 8 --repeat 3 cassettes/plus.json
+
+Every run starts from an empty in-memory database.
+"""
+import argparse
+import json
+import os
+from timeit import default_timer as timer
+
+os.environ['TEST_DATABASE_URL'] = 'sqlite://'
+
+from app import create_app, db
+from crawler.async_crawler import AsyncWebCrawler
+from crawler.ratelimit import AdaptiveRateLimiter
+from crawler.replay import Cassette, ReplayServer
+from crawler.web_crawler import WebCrawler
+
+SEGMENT = "IND.NEW.POSTPAID.MNP"
+
+
+def run_crawl(server, concurrency, unlimited):
+    limiter = None
+    if unlimited:
+        limiter = AdaptiveRateLimiter(ceilings={
+            'DEVICE_LIST': 1e6, 'DEVICE_PRICES': 1e6,
+            'DEVICE_AVAILABLE': 1e6, 'PRODUCT_PAGE': 1e6
+        }, rate=1e6)
+    if concurrency:
+        transport = server.transport(pool_size=concurrency, limiter=limiter)
+        crawler = AsyncWebCrawler(SEGMENT, concurrency=concurrency,
+                                  transport=transport)
+    else:
+        crawler = WebCrawler(SEGMENT,
+                             transport=server.transport(limiter=limiter))
+    devices = []
+    save_or_update_devices = crawler.save_or_update_devices
+
+    def counting_save(page_devices, offer_info):
+        devices.append(len(page_devices))
+        save_or_update_devices(page_devices, offer_info)
+
+    crawler.save_or_update_devices = counting_save
+    db.drop_all()
+    db.create_all()
+    server.misses = 0
+    start = timer()
+    crawler.crawl()
+    seconds = timer() - start
+    requests = sum(stats['requests']
+                   for stats in crawler.transport.summary().values())
+    return {
+        'seconds': seconds,
+        'requests': requests,
+        'devices': sum(devices),
+        'requests_per_second': requests / seconds,
+        'devices_per_second': sum(devices) / seconds,
+        'endpoints': crawler.transport.summary(),
+        'stages': crawler.stages.to_json(),
+        'duplicate_devices': crawler.duplicate_devices,
+        'not_recorded': server.misses,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('cassette')
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--errors', type=float, default=0.0,
+                        help='share of requests answered with 503')
+    parser.add_argument('--concurrency', type=int, default=0,
+                        help='AsyncWebCrawler concurrency, 0 for WebCrawler')
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--unlimited', action='store_true',
+                        help='lift rate limits to measure the crawler alone')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    server = ReplayServer(Cassette(args.cassette), latency=args.latency,
+                          jitter=args.jitter, error_rate=args.errors,
+                          seed=args.seed).start()
+    app = create_app('testing')
+    with app.app_context():
+        try:
+            for _ in range(args.repeat):
+                print(json.dumps(run_crawl(server, args.concurrency,
+                                           args.unlimited), sort_keys=True))
+        finally:
+            db.session.remove()
+            db.drop_all()
+            server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+DEVICE_LIST decoding: r.json() on the whole body vs crawler.streaming.
+
+Runs on the largest device pages of a cassette recorded by
+`manage.py record_cassette`:
+
+    python -m benchmarks.device_list --largest 20 --repeat 10 \
+        cassettes/plus.json
+
+Peak memory is the peak of allocations made while decoding one page, as
+traced by tracemalloc. Bodies are loaded up front for both approaches, so
+it leaves out the whole body r.json() also needs in memory.
+"""
+import argparse
+import json
+import tracemalloc
+from timeit import default_timer as timer
+
+from config import Config
+from crawler.replay import Cassette
+from crawler.streaming import CHUNK_SIZE, JSONObjectStream, slim_device
+
+
+def whole_body_devices(content):
+    """WebCrawler._device_page before crawler.streaming"""
+    return json.loads(content.decode('utf-8'))['devices']
+
+
+def streamed_devices(content):
+    chunks = (content[start:start + CHUNK_SIZE]
+              for start in range(0, len(content), CHUNK_SIZE))
+    return [slim_device(device) for key, device in JSONObjectStream(chunks)
+            if key == 'devices']
+
+
+APPROACHES = {
+    'json': whole_body_devices,
+    'streamed': streamed_devices,
+}
+
+
+def device_pages(cassette, largest):
+    """:return: bodies of the `largest` recorded pages of devices"""
+    pages = []
+    for key, exchange in cassette.exchanges.items():
+        method, path, form = json.loads(key)
+        if exchange['status'] != 200 or \
+                not Config.DEVICE_LIST.endswith(path) or \
+                'page' not in dict(form):
+            continue
+        pages.append(exchange['body'].encode('utf-8', 'surrogateescape'))
+    pages.sort(key=len, reverse=True)
+    return pages[:largest]
+
+
+def run_approach(name, pages, repeat):
+    decode = APPROACHES[name]
+    start = timer()
+    for _ in range(repeat):
+        for content in pages:
+            devices = decode(content)
+    seconds = timer() - start
+    peak = 0
+    for content in pages:
+        tracemalloc.start()
+        devices = decode(content)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        del devices
+    return {
+        'approach': name,
+        'ms_per_page': 1000.0 * seconds / (len(pages) * repeat),
+        'peak_kb': peak / 1024.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('cassette')
+    parser.add_argument('--largest', type=int, default=20,
+                        help='number of device pages to decode')
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+    pages = device_pages(Cassette(args.cassette), args.largest)
+    if not pages:
+        parser.error('no device pages recorded in %s' % args.cassette)
+    print("%d pages, largest %.1f kB" % (len(pages), len(pages[0]) / 1024.0))
+    print("%-10s %12s %12s" % ('approach', 'ms/page', 'peak kB'))
+    for name in sorted(APPROACHES):
+        result = run_approach(name, pages, args.repeat)
+        print("%-10s %12.3f %12.1f" % (name, result['ms_per_page'],
+                                       result['peak_kb']))
+
+
+if __name__ == '__main__':
+    main()
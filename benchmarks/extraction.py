@@ -0,0 +1,94 @@
+"""
+Product page extraction: full BeautifulSoup tree vs crawler.extraction.
+
+Every approach runs in its own process, so peak RSS is not shared:
+
+    python -m benchmarks.extraction --repeat 20 saved_pages/*.html
+"""
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import warnings
+from timeit import default_timer as timer
+
+from bs4 import BeautifulSoup as Soup
+
+from crawler.extraction import extract_photo_urls, extract_skus
+
+# the full tree approach relied on bs4 guessing the parser
+warnings.filterwarnings('ignore', category=UserWarning, module='bs4')
+
+
+def full_tree_skus(html):
+    """WebCrawler._all_skus before crawler.extraction"""
+    parsed_html = Soup(html)
+    skus = parsed_html.find_all('input', attrs={'name': 'color'})
+    return [sku['device-skus'] for sku in skus]
+
+
+def full_tree_photo_urls(html):
+    """WebCrawler.find_all_photos before crawler.extraction"""
+    parsed_html = Soup(html)
+    photo_container = parsed_html.find('div', attrs={'id': 'phone-carousel'})
+    return [img.attrs['src'] for img in photo_container.find_all('img')]
+
+
+APPROACHES = {
+    'full_tree': (full_tree_skus, full_tree_photo_urls),
+    'strained': (extract_skus, extract_photo_urls),
+}
+
+
+def peak_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run_approach(name, paths, repeat):
+    pages = []
+    for path in paths:
+        with open(path, 'rb') as page:
+            pages.append(page.read())
+    skus, photo_urls = APPROACHES[name]
+    rss_before = peak_rss_kb()
+    start = timer()
+    for _ in range(repeat):
+        for html in pages:
+            skus(html)
+            photo_urls(html)
+    seconds = timer() - start
+    return {
+        'approach': name,
+        'pages_per_sec': len(pages) * repeat / seconds,
+        'peak_rss_kb': peak_rss_kb(),
+        'rss_growth_kb': peak_rss_kb() - rss_before
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('pages', nargs='+', help='saved product pages')
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--approach', choices=sorted(APPROACHES),
+                        help='run one approach in this process')
+    args = parser.parse_args()
+    if args.approach:
+        print(json.dumps(run_approach(args.approach, args.pages,
+                                      args.repeat)))
+        return
+    print("%-10s %12s %14s %16s" % ('approach', 'pages/sec', 'peak RSS kB',
+                                    'RSS growth kB'))
+    for name in sorted(APPROACHES):
+        output = subprocess.check_output(
+            [sys.executable, '-m', 'benchmarks.extraction', '--approach',
+             name, '--repeat', str(args.repeat)] + args.pages
+        )
+        result = json.loads(output.decode('utf-8'))
+        print("%-10s %12.1f %14d %16d" % (
+            name, result['pages_per_sec'], result['peak_rss_kb'],
+            result['rss_growth_kb']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+/skus/ serialization: SKU.to_json for every sku vs SKU.query_to_json.
+
+Runs on a generated catalog in an in-memory database, every product with
+3 skus and every sku with 2 photos and 3 offers:
+
+    python -m benchmarks.skus_json --skus 1000 10000 --repeat 3
+"""
+import argparse
+import os
+from timeit import default_timer as timer
+
+os.environ['TEST_DATABASE_URL'] = 'sqlite://'
+
+from sqlalchemy import event
+
+from app import create_app, db
+from app.models import Offer, Photo, Product, SKU
+
+
+def populate(count):
+    """Fills an empty catalog with `count` skus"""
+    db.drop_all()
+    db.create_all()
+    for i in range(count):
+        if i % 3 == 0:
+            product = Product(manufacturer='Nokia', model_name='Lumia %d' % i,
+                              product_type='PHONE')
+            db.session.add(product)
+        sku = SKU(base_product=product, stock_code='lumia-%d' % i,
+                  availability='AVAILABLE')
+        db.session.add(sku)
+        for default in (True, False):
+            db.session.add(Photo(sku=sku, default=default,
+                                 url='http://photo.com/%d/%s.jpg'
+                                     % (i, default)))
+        for tariff in ('15F2F', '15F3F', '15F4F'):
+            db.session.add(Offer(
+                segmentation='IND.NEW.POSTPAID.ACQ', sku=sku, market='IND',
+                offer_code='NSZAS24A', tariff_plan_code=tariff,
+                contract_condition_code='24A'
+            ))
+    db.session.commit()
+
+
+def lazy(query):
+    """get_skus before SKU.query_to_json"""
+    return [sku.to_json() for sku in query]
+
+
+APPROACHES = {
+    'lazy': lazy,
+    'batched': SKU.query_to_json,
+}
+
+
+def run_approach(name, repeat):
+    queries = []
+
+    def count(*args):
+        queries.append(1)
+
+    serialize = APPROACHES[name]
+    event.listen(db.engine, 'before_cursor_execute', count)
+    start = timer()
+    for _ in range(repeat):
+        # rows loaded by the previous run would make lazy loads free
+        db.session.expunge_all()
+        serialize(SKU.query.order_by(SKU.id))
+    seconds = timer() - start
+    event.remove(db.engine, 'before_cursor_execute', count)
+    return seconds * 1000.0 / repeat, len(queries) // repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--skus', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    app = create_app('testing')
+    with app.test_request_context():
+        print("%8s %-8s %12s %10s" % ('skus', 'approach', 'ms', 'queries'))
+        for count in sorted(args.skus):
+            populate(count)
+            for name in sorted(APPROACHES):
+                ms, queries = run_approach(name, args.repeat)
+                print("%8d %-8s %12.1f %10d" % (count, name, ms, queries))
+        db.drop_all()
+
+
+if __name__ == '__main__':
+    main()
@@ -18,6 +18,62 @@ class Config:
                        "frontend_INSTANCE_T3lq&p_p_lifecycle=2&p_p_resource_" \
                        "id=deviceAvailable"
 
+    # API collections, ?per_page= is capped at API_MAX_PER_PAGE
+    API_PER_PAGE = 20
+    API_MAX_PER_PAGE = 100
+
+    CRAWLER_CONCURRENCY = int(os.environ.get('CRAWLER_CONCURRENCY') or 8)
+    CRAWLER_FETCH_WORKERS = int(os.environ.get('CRAWLER_FETCH_WORKERS') or 4)
+    CRAWLER_QUEUE_SIZE = int(os.environ.get('CRAWLER_QUEUE_SIZE') or 32)
+    CRAWLER_DISCOVERY_BATCH = 50
+    CRAWLER_AVAILABILITY_CHUNK = 500
+    CRAWLER_POOL_SIZE = int(os.environ.get('CRAWLER_POOL_SIZE') or 10)
+    CRAWLER_TIMEOUT = float(os.environ.get('CRAWLER_TIMEOUT') or 30)
+    CRAWLER_RETRIES = int(os.environ.get('CRAWLER_RETRIES') or 3)
+    CRAWLER_BACKOFF = float(os.environ.get('CRAWLER_BACKOFF') or 0.5)
+    # requests per second, tuned between floor and per endpoint ceiling
+    CRAWLER_RATE_START = 5.0
+    CRAWLER_RATE_FLOOR = 0.5
+    CRAWLER_RATE_CEILINGS = {
+        'DEVICE_LIST': 20.0,
+        'DEVICE_PRICES': 20.0,
+        'DEVICE_AVAILABLE': 20.0,
+        'PRODUCT_PAGE': 5.0,
+    }
+    CRAWLER_CACHE_DIR = os.environ.get('CRAWLER_CACHE_DIR') or \
+        os.path.join(BASE_DIR, 'cache')
+    CRAWLER_CACHE_MAX_BYTES = 64 * 1024 * 1024
+    # one JSON line of per-endpoint and per-stage metrics for every crawl
+    CRAWLER_METRICS_FILE = os.environ.get('CRAWLER_METRICS_FILE') or \
+        os.path.join(BASE_DIR, 'logs', 'crawler_metrics.jsonl')
+    # requests per hour and seconds, see crawler.scheduler
+    CRAWLER_SCHEDULER_BUDGET = int(
+        os.environ.get('CRAWLER_SCHEDULER_BUDGET') or 3000)
+    CRAWLER_SCHEDULER_MIN_INTERVAL = 15 * 60
+    CRAWLER_SCHEDULER_MAX_INTERVAL = 24 * 60 * 60
+    CRAWLER_SCHEDULER_DISCOVERY_INTERVAL = 6 * 60 * 60
+    CRAWLER_SCHEDULER_POLL = 60
+    CRAWLER_SCHEDULER_STATE = os.environ.get('CRAWLER_SCHEDULER_STATE') or \
+        os.path.join(BASE_DIR, 'logs', 'scheduler.json')
+    # crawl work queue shared by crawl workers, see crawler.workqueue
+    CRAWLER_LEASE_SECONDS = 120
+    CRAWLER_LEASE_BATCH = 4
+    CRAWLER_MAX_ATTEMPTS = 5
+    CRAWLER_WORKER_POLL = 5
+    # progress of running crawls, kept until they finish
+    CRAWLER_FRONTIER_DIR = os.environ.get('CRAWLER_FRONTIER_DIR') or \
+        os.path.join(BASE_DIR, 'frontier')
+    # recorded upstream responses served by crawler.replay
+    CRAWLER_CASSETTE = os.environ.get('CRAWLER_CASSETTE') or \
+        os.path.join(BASE_DIR, 'cassettes', 'plus.json')
+    # seconds; only lookups of contract conditions and page counts
+    # (DEVICE_LIST) and probes whether an offer has prices (DEVICE_PRICES)
+    # are cached, offer lists, prices and availability never are
+    CRAWLER_CACHE_TTL = {
+        'DEVICE_LIST': 6 * 60 * 60,
+        'DEVICE_PRICES': 6 * 60 * 60,
+    }
+
     SEGMENTS = [
         "IND.NEW.POSTPAID.ACQ",
         "IND.NEW.POSTPAID.MNP",
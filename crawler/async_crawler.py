@@ -0,0 +1,117 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from app import db
+from app.models import SKU
+from config import Config
+from .transport import Transport
+from .web_crawler import WebCrawler
+
+
+class AsyncWebCrawler(WebCrawler):
+    """
+    Crawls a segment keeping up to `concurrency` upstream requests in flight.
+
+    requests is blocking, so every upstream call runs in a thread pool
+    executor which bounds the number of calls in flight. Devices are saved
+    in the event loop thread only, because db.session belongs to the thread
+    which pushed the app context.
+    """
+    def __init__(self, segment, concurrency=None, transport=None,
+                 cache=None, incremental=False, frontier=None):
+        self.concurrency = concurrency or Config.CRAWLER_CONCURRENCY
+        super().__init__(
+            segment, transport or Transport(pool_size=self.concurrency),
+            cache, incremental, frontier
+        )
+        self._executor = None
+
+    def run(self, coroutine):
+        """Runs given coroutine to completion in a fresh event loop"""
+        loop = asyncio.new_event_loop()
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        try:
+            return loop.run_until_complete(coroutine)
+        finally:
+            self._executor.shutdown()
+            self._executor = None
+            loop.close()
+
+    async def _fetch(self, method, *args):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(method, *args)
+        )
+
+    async def _fetch_page(self, offer, page):
+        devices_json = await self._fetch(self._device_page, offer, page)
+        return offer, page, devices_json
+
+    async def fetch_offers(self):
+        contract_conditions = await self._fetch(
+            self.available_contract_conditions
+        )
+        offer_lists = await asyncio.gather(*[
+            self._fetch(self.offer_list, [contract_condition])
+            for contract_condition in contract_conditions
+        ])
+        return [offer for offers in offer_lists for offer in offers]
+
+    async def _crawl_devices(self):
+        """
+        First pages of all offers are fetched at once; as soon as one
+        arrives, it tells how many more pages of that offer to fetch.
+        Pages done according to the frontier are skipped.
+        """
+        frontier = self.frontier
+
+        def remaining_pages(offer, pages):
+            return {
+                asyncio.ensure_future(self._fetch_page(offer, page))
+                for page in range(2, pages + 1)
+                if not (frontier and frontier.is_page_done(offer, page))
+            }
+
+        offers = await self.fetch_offers()
+        pending = set()
+        for offer in offers:
+            pages = frontier.pages(offer) if frontier else None
+            if pages is None or not frontier.is_page_done(offer, 1):
+                pending.add(asyncio.ensure_future(self._fetch_page(offer, 1)))
+            else:
+                pending.update(remaining_pages(offer, pages))
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for fetch in done:
+                offer, page, devices_json = fetch.result()
+                if page == 1:
+                    pages = devices_json['pageInfo']['pages']
+                    if frontier:
+                        frontier.set_pages(offer, pages)
+                    pending.update(remaining_pages(offer, pages))
+                self.save_or_update_devices(devices_json["devices"], offer)
+                if frontier:
+                    frontier.mark_page_done(offer, page)
+
+    async def check_availabilities(self, skus):
+        availabilities = await asyncio.gather(*[
+            self._fetch(self.check_availability, sku.stock_code)
+            for sku in skus
+        ])
+        return zip(skus, availabilities)
+
+    def crawl_devices(self):
+        self.run(self._crawl_devices())
+        self.save_price_history()
+        self.mark_inactive_offers()
+
+    def update_availability(self):
+        """Used in a daily availability check"""
+        skus = SKU.query.all()
+        for sku, availability in self.run(self.check_availabilities(skus)):
+            sku.availability = availability
+            db.session.add(sku)
+        db.session.commit()
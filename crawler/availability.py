@@ -0,0 +1,62 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from app import db
+from app.models import SKU
+from config import Config
+
+
+def _sku_chunks(chunk_size):
+    """Yields (id, stock code, availability) of all skus, chunk by chunk"""
+    last_id = 0
+    while True:
+        chunk = db.session.query(SKU.id, SKU.stock_code, SKU.availability) \
+            .filter(SKU.id > last_id).order_by(SKU.id).limit(chunk_size).all()
+        if not chunk:
+            return
+        yield chunk
+        last_id = chunk[-1][0]
+
+
+def refresh_availability(crawler, workers=None, chunk_size=None,
+                         frontier=None):
+    """
+    Checks availability of every sku with `workers` concurrent requests.
+
+    Skus are read `chunk_size` at a time, and only the ones whose
+    availability flipped are written, with one UPDATE per chunk.
+    :param frontier: checkpoint.Frontier; skus it has as probed are
+    skipped, and skus of every committed chunk are marked probed
+    :return: number of checked and flipped skus
+    """
+    workers = workers or Config.CRAWLER_CONCURRENCY
+    chunk_size = chunk_size or Config.CRAWLER_AVAILABILITY_CHUNK
+    stats = {'skus': 0, 'flipped': 0}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for chunk in _sku_chunks(chunk_size):
+            if frontier:
+                chunk = [row for row in chunk
+                         if not frontier.is_probed(row[1])]
+                if not chunk:
+                    continue
+            availabilities = executor.map(
+                crawler.check_availability,
+                [stock_code for _, stock_code, _ in chunk]
+            )
+            flipped = {
+                sku_id: availability
+                for (sku_id, _, old_availability), availability
+                in zip(chunk, availabilities)
+                if availability != old_availability
+            }
+            if flipped:
+                with crawler.stages.stage('db'):
+                    SKU.query.filter(SKU.id.in_(flipped)).update(
+                        {SKU.availability: db.case(flipped, value=SKU.id)},
+                        synchronize_session=False
+                    )
+                    db.session.commit()
+            if frontier:
+                frontier.mark_probed([stock_code for _, stock_code, _ in chunk])
+            stats['skus'] += len(chunk)
+            stats['flipped'] += len(flipped)
+    return stats
@@ -0,0 +1,123 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from config import Config
+from .transport import endpoint_name
+
+
+class CachedResponse:
+    """Minimal stand-in for requests.Response served from cache"""
+    def __init__(self, content, status_code=200):
+        self.content = content
+        self.status_code = status_code
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8')
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class ResponseCache:
+    """
+    On-disk cache of upstream responses keyed by endpoint and form data.
+
+    Only calls marked cacheable by the crawler get here. Every endpoint has
+    its own time to live (Config.CRAWLER_CACHE_TTL); endpoints without one
+    are never cached. When the directory grows over `max_bytes` the oldest
+    entries are evicted. With `bypass` set, cached entries are not read but
+    fresh responses are still stored.
+    """
+    def __init__(self, directory=None, ttl=None, max_bytes=None,
+                 bypass=False):
+        self.directory = directory or Config.CRAWLER_CACHE_DIR
+        self.ttl = Config.CRAWLER_CACHE_TTL if ttl is None else ttl
+        self.max_bytes = max_bytes or Config.CRAWLER_CACHE_MAX_BYTES
+        self.bypass = bypass
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+        self._sizes = {}
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            self._sizes[path] = os.path.getsize(path)
+
+    @staticmethod
+    def key(url, data):
+        raw = json.dumps([url, sorted((data or {}).items())])
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def _path(self, url, data):
+        return os.path.join(self.directory, self.key(url, data))
+
+    def is_cacheable(self, url):
+        return self.ttl.get(endpoint_name(url), 0) > 0
+
+    def get(self, url, data=None):
+        if self.bypass or not self.is_cacheable(url):
+            return None
+        path = self._path(url, data)
+        try:
+            with open(path, 'rb') as cached:
+                header = json.loads(cached.readline().decode('utf-8'))
+                content = cached.read()
+        except (IOError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        if time.time() - header['stored_at'] > \
+                self.ttl[endpoint_name(url)]:
+            self._remove(path)
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return CachedResponse(content, header['status_code'])
+
+    def set(self, url, data, response):
+        if not self.is_cacheable(url) or response.status_code != 200:
+            return
+        path = self._path(url, data)
+        header = json.dumps({'stored_at': time.time(),
+                             'status_code': response.status_code})
+        tmp_path = '%s.%d.tmp' % (path, threading.get_ident())
+        with open(tmp_path, 'wb') as cached:
+            cached.write(header.encode('utf-8') + b'\n')
+            cached.write(response.content)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._sizes[path] = os.path.getsize(path)
+        self._evict()
+
+    def _remove(self, path):
+        with self._lock:
+            self._sizes.pop(path, None)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _evict(self):
+        with self._lock:
+            total = sum(self._sizes.values())
+            if total <= self.max_bytes:
+                return
+            paths = list(self._sizes)
+        for path in sorted(paths, key=self._mtime):
+            if total <= self.max_bytes:
+                break
+            total -= self._sizes.get(path, 0)
+            self._remove(path)
+
+    @staticmethod
+    def _mtime(path):
+        try:
+            return os.path.getmtime(path)
+        except OSError:
+            return 0
@@ -0,0 +1,121 @@
+import datetime
+import json
+import os
+import threading
+import time
+
+from config import Config
+
+
+def _offer_key(offer):
+    return (offer["contractConditionCode"], offer["offerNSICode"],
+            offer["tariffPlanCode"])
+
+
+class Frontier:
+    """
+    Progress of one crawl job, persisted as an append-only JSON lines file:
+    page counts of offers, device pages already saved and skus already
+    probed for availability.
+
+    Every run appends a start record, so on resume the time between the
+    start of an earlier run and its last saved unit is work that does not
+    have to be done again (`recovered_seconds`). The first run also
+    records when the crawl started (`scrapping_time`), so offers saved by
+    any run of it carry the same scrapping date.
+    """
+    TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+    def __init__(self, segment, job, directory=None):
+        """
+        :param job: name of the command running the crawl, so commands
+        crawling the same segment never resume or clear each other's
+        progress
+        """
+        directory = directory or Config.CRAWLER_FRONTIER_DIR
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, '%s.%s.jsonl' % (segment, job))
+        self.page_counts = {}
+        self.done_pages = set()
+        self.probed_skus = set()
+        self.recovered_seconds = 0.0
+        self.scrapping_time = None
+        self._lock = threading.Lock()
+
+    def _write(self, record):
+        record['at'] = time.time()
+        line = json.dumps(record) + '\n'
+        with self._lock:
+            with open(self.path, 'a') as frontier:
+                frontier.write(line)
+
+    def start(self, resume=False):
+        """Loads progress of earlier runs if resuming, forgets it if not"""
+        if resume and os.path.exists(self.path):
+            self._load()
+        else:
+            self.clear()
+        if self.scrapping_time is None:
+            self.scrapping_time = datetime.datetime.utcnow()
+        self._write({'start': True, 'crawl':
+                     self.scrapping_time.strftime(self.TIME_FORMAT)})
+
+    def _load(self):
+        run_started_at = last_done_at = None
+        with open(self.path) as frontier:
+            for line in frontier:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # line cut short by a crash
+                    continue
+                if 'start' in record:
+                    if run_started_at and last_done_at:
+                        self.recovered_seconds += last_done_at - run_started_at
+                    run_started_at, last_done_at = record['at'], None
+                    if self.scrapping_time is None and 'crawl' in record:
+                        self.scrapping_time = datetime.datetime.strptime(
+                            record['crawl'], self.TIME_FORMAT)
+                    continue
+                last_done_at = record['at']
+                if 'pages' in record:
+                    self.page_counts[tuple(record['offer'])] = record['pages']
+                elif 'page' in record:
+                    self.done_pages.add((tuple(record['offer']),
+                                         record['page']))
+                elif 'sku' in record:
+                    self.probed_skus.add(record['sku'])
+        if run_started_at and last_done_at:
+            self.recovered_seconds += last_done_at - run_started_at
+
+    def clear(self):
+        """Forgets progress, e.g. once the job is finished"""
+        with self._lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+        self.page_counts = {}
+        self.done_pages = set()
+        self.probed_skus = set()
+        self.scrapping_time = None
+
+    def pages(self, offer):
+        return self.page_counts.get(_offer_key(offer))
+
+    def set_pages(self, offer, pages):
+        self.page_counts[_offer_key(offer)] = pages
+        self._write({'offer': _offer_key(offer), 'pages': pages})
+
+    def is_page_done(self, offer, page):
+        return (_offer_key(offer), page) in self.done_pages
+
+    def mark_page_done(self, offer, page):
+        self.done_pages.add((_offer_key(offer), page))
+        self._write({'offer': _offer_key(offer), 'page': page})
+
+    def is_probed(self, stock_code):
+        return stock_code in self.probed_skus
+
+    def mark_probed(self, stock_codes):
+        self.probed_skus.update(stock_codes)
+        for stock_code in stock_codes:
+            self._write({'sku': stock_code})
@@ -0,0 +1,146 @@
+import datetime
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from app import db
+from app.models import Offer, Photo, PriceChange, Product, SKU
+from config import Config
+
+
+def colors_fingerprint(stock_codes):
+    raw = json.dumps(sorted(stock_codes))
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:16]
+
+
+def _template_offers(product_ids=None):
+    """
+    New skus of a product are offered with the same codes as its first
+    saved sku which has offers.
+    :param product_ids: limits templates to these products
+    :return: offers of that sku by product id
+    """
+    query = db.session.query(SKU.base_product_id, db.func.min(SKU.id)) \
+        .join(Offer, Offer.sku_id == SKU.id)
+    if product_ids is not None:
+        query = query.filter(SKU.base_product_id.in_(product_ids))
+    template_skus = dict(query.group_by(SKU.base_product_id))
+    product_ids = {sku_id: product_id
+                   for product_id, sku_id in template_skus.items()}
+    templates = {}
+    if product_ids:
+        for offer in Offer.query.filter(
+                Offer.sku_id.in_(product_ids)).order_by(Offer.id):
+            templates.setdefault(product_ids[offer.sku_id], []).append(offer)
+    return templates
+
+
+def discover_new_skus(crawler, workers=None, batch_size=None,
+                      product_ids=None, commit=True):
+    """
+    Concurrent version of WebCrawler.save_new_found_skus.
+
+    Product pages, availability checks, price probes and photo pages are
+    fetched by `workers` threads. Products whose colour list is the same
+    as in the last discovery are skipped. Rows are created in the calling
+    thread and committed every `batch_size` products.
+    :param product_ids: only these products are searched, all if None
+    :param commit: if False, the last batch is left for the caller to
+    commit, e.g. together with its own changes
+    :return: discovery statistics
+    """
+    workers = workers or Config.CRAWLER_CONCURRENCY
+    batch_size = batch_size or Config.CRAWLER_DISCOVERY_BATCH
+    stats = {'products': 0, 'unchanged_products': 0, 'new_skus': 0,
+             'new_offers': 0}
+    templates = _template_offers(product_ids)
+    if not templates:
+        return stats
+    products = Product.query.filter(Product.id.in_(templates)) \
+        .order_by(Product.id).all()
+    stats['products'] = len(products)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # =================== Product pages ======================= #
+        colors = executor.map(
+            crawler._all_skus,
+            [templates[product.id][0].offer_url for product in products]
+        )
+        changed = []
+        for product, stock_codes in zip(products, colors):
+            fingerprint = colors_fingerprint(stock_codes)
+            if product.colors_fingerprint == fingerprint:
+                stats['unchanged_products'] += 1
+            else:
+                changed.append((product, stock_codes, fingerprint))
+        found_codes = {code for _, codes, _ in changed for code in codes}
+        saved_codes = set()
+        if found_codes:
+            saved_codes = {
+                stock_code for stock_code, in db.session.query(
+                    SKU.stock_code).filter(SKU.stock_code.in_(found_codes))
+            }
+        new_skus = []
+        for product, stock_codes, _ in changed:
+            for stock_code in stock_codes:
+                if stock_code not in saved_codes:
+                    saved_codes.add(stock_code)
+                    new_skus.append((product, stock_code))
+
+        # ================ Availability and prices ================ #
+        availabilities = executor.map(
+            crawler.check_availability,
+            [stock_code for _, stock_code in new_skus]
+        )
+        probes = [(offer, stock_code) for product, stock_code in new_skus
+                  for offer in templates[product.id]]
+        priced = iter(list(executor.map(
+            lambda probe: crawler._has_prices(*probe), probes
+        )))
+        skus_by_product = {}
+        first_offers = []
+        for (product, stock_code), availability in zip(new_skus,
+                                                       availabilities):
+            sku = SKU(stock_code=stock_code, base_product=product)
+            sku.availability = availability
+            offers = [crawler._copy_offer(offer, sku)
+                      for offer in templates[product.id] if next(priced)]
+            skus_by_product.setdefault(product, []).append((sku, offers))
+            first_offers.append(offers[0] if offers else None)
+
+        # =================== Photos ======================= #
+        photo_urls = iter(list(executor.map(
+            lambda offer: crawler._photo_urls(offer.offer_url) if offer
+            else [],
+            first_offers
+        )))
+
+    # =================== Saving ======================= #
+    discovered_at = datetime.datetime.utcnow()
+    batch_offers = []
+
+    def save_batch(last=False):
+        # new offers are not crawled yet, so they start their price history
+        db.session.flush()
+        db.session.add_all(PriceChange.first_rows(batch_offers,
+                                                  discovered_at))
+        del batch_offers[:]
+        if commit or not last:
+            crawler._commit_keeping_rows()
+
+    with crawler.stages.stage('db'):
+        for i, (product, _, fingerprint) in enumerate(changed):
+            for sku, offers in skus_by_product.get(product, []):
+                db.session.add(sku)
+                db.session.add_all(offers)
+                batch_offers.extend(offers)
+                for position, url in enumerate(next(photo_urls)):
+                    db.session.add(Photo(sku=sku, url=url,
+                                         default=position == 0))
+                stats['new_skus'] += 1
+                stats['new_offers'] += len(offers)
+            product.colors_fingerprint = fingerprint
+            db.session.add(product)
+            if (i + 1) % batch_size == 0 and i + 1 < len(changed):
+                save_batch()
+        save_batch(last=True)
+    return stats
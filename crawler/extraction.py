@@ -0,0 +1,19 @@
+from bs4 import BeautifulSoup as Soup, SoupStrainer
+
+# Only these fragments of a product page are built into a tree,
+# the rest is tokenized by the parser and thrown away
+COLOR_INPUTS = SoupStrainer('input', attrs={'name': 'color'})
+PHOTO_CAROUSEL = SoupStrainer('div', attrs={'id': 'phone-carousel'})
+
+
+def extract_skus(html):
+    """:return: stock codes of all colour variants offered on the page"""
+    parsed_html = Soup(html, 'html.parser', parse_only=COLOR_INPUTS)
+    return [sku['device-skus']
+            for sku in parsed_html.find_all('input', attrs={'name': 'color'})]
+
+
+def extract_photo_urls(html):
+    """:return: photo urls of the carousel, main photo first"""
+    parsed_html = Soup(html, 'html.parser', parse_only=PHOTO_CAROUSEL)
+    return [img.attrs['src'] for img in parsed_html.find_all('img')]
@@ -0,0 +1,59 @@
+from app.models import Offer, Photo, Product, SKU
+
+
+class IdentityMap:
+    """
+    Crawl scoped index of saved rows by their natural keys:
+    products by (manufacturer, model name), skus by stock code, photos by
+    url and offers of the segment by (offer code, tariff plan code,
+    contract condition code, sku stock code).
+
+    Loaded once per segment and kept up to date by the crawler, so repeated
+    lookups of the same row are dictionary hits instead of queries.
+    """
+    KINDS = ('products', 'skus', 'photos', 'offers')
+
+    def __init__(self, segment):
+        self.segment = segment
+        self.loaded = False
+        self.rows = {kind: {} for kind in self.KINDS}
+        self.hits = dict.fromkeys(self.KINDS, 0)
+        self.misses = dict.fromkeys(self.KINDS, 0)
+
+    @staticmethod
+    def offer_key(offer_info, stock_code):
+        return (offer_info["offerNSICode"], offer_info["tariffPlanCode"],
+                offer_info["contractConditionCode"], stock_code)
+
+    def preload(self):
+        for product in Product.query:
+            self.add('products', (product.manufacturer, product.model_name),
+                     product)
+        stock_codes_by_id = {}
+        for sku in SKU.query:
+            self.add('skus', sku.stock_code, sku)
+            stock_codes_by_id[sku.id] = sku.stock_code
+        for photo in Photo.query:
+            self.add('photos', photo.url, photo)
+        for offer in Offer.query.filter_by(segmentation=self.segment):
+            self.add('offers', (offer.offer_code, offer.tariff_plan_code,
+                                offer.contract_condition_code,
+                                stock_codes_by_id.get(offer.sku_id)), offer)
+        self.loaded = True
+
+    def add(self, kind, key, row):
+        self.rows[kind][key] = row
+
+    def get(self, kind, key):
+        return self.rows[kind].get(key)
+
+    def missing(self, kind, keys):
+        """Counts lookups of `keys` and returns the ones not indexed yet"""
+        missing = {key for key in keys if key not in self.rows[kind]}
+        self.hits[kind] += len(keys) - len(missing)
+        self.misses[kind] += len(missing)
+        return missing
+
+    def summary(self):
+        return {kind: {'hits': self.hits[kind], 'misses': self.misses[kind]}
+                for kind in self.KINDS}
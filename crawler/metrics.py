@@ -0,0 +1,95 @@
+import bisect
+import contextlib
+import datetime
+import json
+import math
+import os
+import threading
+from timeit import default_timer as timer
+
+from config import Config
+
+
+class LatencyHistogram:
+    """
+    Latencies counted in buckets growing by a factor of 2 ** (1/4), from
+    1 ms to about 2 minutes, so percentiles are exact to within ~19%.
+    """
+    BOUNDS = [0.001 * 2 ** (i / 4.0) for i in range(69)]
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.counts[bisect.bisect_left(self.BOUNDS, seconds)] += 1
+        self.count += 1
+        self.max = max(self.max, seconds)
+
+    def percentile(self, q):
+        """:return: upper bound of the bucket holding q-th latency"""
+        if not self.count:
+            return None
+        rank = max(1, int(math.ceil(q / 100.0 * self.count)))
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self.BOUNDS[i], self.max) \
+                    if i < len(self.BOUNDS) else self.max
+
+    def to_json(self):
+        return {'p50': self.percentile(50), 'p95': self.percentile(95),
+                'p99': self.percentile(99), 'max': self.max}
+
+
+class StageTimer:
+    """
+    Time spent in crawl stages: fetch (waiting for upstream, including
+    rate limits and retries, and decoding streamed DEVICE_LIST bodies),
+    parse (other JSON and HTML) and db. Times of
+    concurrent threads add up, so stages may sum to more than wall time.
+    """
+    STAGES = ('fetch', 'parse', 'db')
+
+    def __init__(self):
+        self.seconds = dict.fromkeys(self.STAGES, 0.0)
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = timer()
+        try:
+            yield
+        finally:
+            elapsed = timer() - start
+            with self._lock:
+                self.seconds[name] += elapsed
+
+    def to_json(self):
+        return dict(self.seconds)
+
+
+def write_metrics(crawler, path=None):
+    """Appends metrics of a finished crawl as one JSON line"""
+    path = path or Config.CRAWLER_METRICS_FILE
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    record = {
+        'time': datetime.datetime.now().isoformat(),
+        'segment': crawler.segment,
+        'requests': crawler.request_counter,
+        'unchanged_devices': crawler.unchanged_devices,
+        'synced_skus': len(crawler.synced_devices),
+        'duplicate_devices': crawler.duplicate_devices,
+        'endpoints': crawler.transport.summary(),
+        'stages': crawler.stages.to_json(),
+        'identity': crawler.identity.summary(),
+    }
+    if crawler.cache is not None:
+        record['cache'] = {'hits': crawler.cache.hits,
+                           'misses': crawler.cache.misses}
+    with open(path, 'a') as metrics:
+        metrics.write(json.dumps(record, sort_keys=True) + '\n')
@@ -0,0 +1,103 @@
+import multiprocessing
+from timeit import default_timer as timer
+
+from app import create_app, db
+from .cache import ResponseCache
+from .checkpoint import Frontier
+from .ratelimit import AdaptiveRateLimiter, set_shared_limiter
+from .web_crawler import WebCrawler
+
+_app = None
+_write_lock = None
+_bypass_cache = False
+_incremental = False
+_resume = False
+_transport = None
+
+
+class SegmentCrawler(WebCrawler):
+    """
+    Crawler used inside a pool worker.
+
+    Segments share products and skus, so two workers could both miss the
+    same Product or SKU and insert it twice. Every write of a worker (pages
+    of devices, price history and deactivated offers) is therefore
+    serialized between workers with a lock shared by the whole pool, which
+    also keeps SQLite from reporting "database is locked", while fetching
+    from upstream stays parallel.
+    """
+    def save_or_update_devices(self, devices, offer_info, commit=True):
+        with _write_lock:
+            super().save_or_update_devices(devices, offer_info, commit)
+
+    def save_price_history(self, offer_info=None, commit=True):
+        with _write_lock:
+            return super().save_price_history(offer_info, commit)
+
+    def mark_inactive_offers(self, offer_info=None):
+        with _write_lock:
+            return super().mark_inactive_offers(offer_info)
+
+
+def _init_worker(config_name, write_lock, bypass_cache, incremental,
+                 workers, resume, transport):
+    global _app, _write_lock, _bypass_cache, _incremental, _resume, \
+        _transport
+    # upstream sees all workers together, so each gets a share of ceilings
+    set_shared_limiter(AdaptiveRateLimiter(scale=1.0 / workers))
+    _app = create_app(config_name)
+    _write_lock = write_lock
+    _bypass_cache = bypass_cache
+    _incremental = incremental
+    _resume = resume
+    _transport = transport
+
+
+def crawl_segment(segment):
+    """
+    Crawls devices of one segment in a pool worker, using its own app
+    context and db session.
+    :return: (segment, seconds, request count, request rates, seconds
+    recovered from an interrupted run)
+    """
+    with _app.app_context():
+        start = timer()
+        frontier = Frontier(segment, 'crawl_all')
+        frontier.start(resume=_resume)
+        crawler = SegmentCrawler(segment,
+                                 transport=_transport and _transport(),
+                                 cache=ResponseCache(bypass=_bypass_cache),
+                                 incremental=_incremental, frontier=frontier)
+        try:
+            crawler.crawl_devices()
+            crawler.save_metrics()
+        finally:
+            db.session.remove()
+        frontier.clear()
+        return segment, timer() - start, crawler.request_counter, \
+            crawler.transport.limiter.rates(), frontier.recovered_seconds
+
+
+def crawl_segments(segments, config_name, workers, bypass_cache=False,
+                   incremental=False, resume=False, transport=None):
+    """
+    Spreads segments across a pool of `workers` processes.
+    Yields per segment summary in order of completion.
+    :param resume: continue segments from their frontier files
+    :param transport: picklable callable building the transport of each
+    worker, Transport by default
+    """
+    write_lock = multiprocessing.Lock()
+    pool = multiprocessing.Pool(workers, initializer=_init_worker,
+                                initargs=(config_name, write_lock,
+                                          bypass_cache, incremental,
+                                          workers, resume, transport))
+    try:
+        for summary in pool.imap_unordered(crawl_segment, segments):
+            yield summary
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
@@ -0,0 +1,101 @@
+import queue
+import threading
+
+from config import Config
+
+_DONE = object()
+
+
+def _put(items, item, stop):
+    """Blocking put which gives up when pipeline is stopped"""
+    while not stop.is_set():
+        try:
+            items.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _get(items, stop):
+    """Blocking get which returns _DONE when pipeline is stopped"""
+    while not stop.is_set():
+        try:
+            return items.get(timeout=0.1)
+        except queue.Empty:
+            pass
+    return _DONE
+
+
+def crawl_pipeline(crawler, fetch_workers=None, queue_size=None):
+    """
+    Crawls devices of crawler's segment as a producer/consumer pipeline.
+
+    One thread streams offers into a bounded queue, `fetch_workers`
+    threads fetch device pages of those offers into another bounded queue,
+    and the calling thread saves pages as they arrive, since db.session
+    belongs to it. Full queues block the stage before them, so fetching
+    never runs far ahead of saving. Saved pages are marked done in
+    crawler's frontier, if it has one.
+    :return: number of saved device pages
+    """
+    fetch_workers = fetch_workers or Config.CRAWLER_FETCH_WORKERS
+    queue_size = queue_size or Config.CRAWLER_QUEUE_SIZE
+    offers = queue.Queue(maxsize=queue_size)
+    pages = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    errors = []
+
+    def produce_offers():
+        try:
+            contract_conditions = crawler.available_contract_conditions()
+            for offer in crawler.iter_offers(contract_conditions):
+                if not _put(offers, offer, stop):
+                    return
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            for _ in range(fetch_workers):
+                _put(offers, _DONE, stop)
+
+    def fetch_pages():
+        try:
+            while True:
+                offer = _get(offers, stop)
+                if offer is _DONE:
+                    break
+                for page, devices in crawler.iter_device_pages(offer):
+                    if not _put(pages, (offer, page, devices), stop):
+                        return
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            _put(pages, _DONE, stop)
+
+    threads = [threading.Thread(target=produce_offers, daemon=True)]
+    threads.extend(threading.Thread(target=fetch_pages, daemon=True)
+                   for _ in range(fetch_workers))
+    for thread in threads:
+        thread.start()
+    saved_pages = 0
+    finished_workers = 0
+    try:
+        while finished_workers < fetch_workers and not stop.is_set():
+            item = _get(pages, stop)
+            if item is _DONE:
+                finished_workers += 1
+                continue
+            offer, page, devices = item
+            crawler.save_or_update_devices(devices, offer)
+            if crawler.frontier:
+                crawler.frontier.mark_page_done(offer, page)
+            saved_pages += 1
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+    if errors:
+        raise errors[0]
+    return saved_pages
@@ -0,0 +1,123 @@
+import threading
+import time
+
+from config import Config
+
+
+class EndpointLimiter:
+    """
+    Token bucket whose rate (requests per second) is tuned with AIMD.
+
+    Every healthy response raises the rate additively, by about
+    `INCREASE` requests per second each second, up to `ceiling`. A failed
+    request (429, 5xx, connection error) or a latency average over
+    `LATENCY_FACTOR` times the best one seen cuts the rate by
+    `DECREASE`, at most once per `COOLDOWN` seconds and not below `floor`.
+    """
+    INCREASE = 1.0
+    DECREASE = 0.5
+    LATENCY_FACTOR = 2.0
+    LATENCY_SMOOTHING = 0.2
+    COOLDOWN = 1.0
+
+    def __init__(self, ceiling, rate=None, floor=None):
+        self.ceiling = ceiling
+        self.floor = min(floor or Config.CRAWLER_RATE_FLOOR, ceiling)
+        self.rate = min(rate or Config.CRAWLER_RATE_START, ceiling)
+        self.tokens = max(1.0, self.rate)
+        self.latency = None
+        self.best_latency = None
+        self._updated_at = time.time()
+        self._decreased_at = 0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(max(1.0, self.rate),
+                          self.tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def acquire(self):
+        """Blocks until a request may be sent"""
+        while True:
+            with self._lock:
+                self._refill(time.time())
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def _decrease(self, now):
+        if now - self._decreased_at < self.COOLDOWN:
+            return
+        self._decreased_at = now
+        self.rate = max(self.floor, self.rate * self.DECREASE)
+
+    def record(self, latency, healthy):
+        with self._lock:
+            now = time.time()
+            if not healthy:
+                self._decrease(now)
+                return
+            if self.latency is None:
+                self.latency = latency
+            else:
+                self.latency += self.LATENCY_SMOOTHING * (latency -
+                                                          self.latency)
+            if self.best_latency is None or self.latency < self.best_latency:
+                self.best_latency = self.latency
+            if self.latency > self.LATENCY_FACTOR * self.best_latency:
+                self._decrease(now)
+            else:
+                self.rate = min(self.ceiling,
+                                self.rate + self.INCREASE / self.rate)
+
+
+class AdaptiveRateLimiter:
+    """
+    One EndpointLimiter per upstream endpoint, each with its own ceiling
+    from Config.CRAWLER_RATE_CEILINGS.
+    :param scale: share of the ceilings given to this process, e.g.
+    1/4 for each of 4 pool workers
+    :param rate: starting rate of every endpoint
+    """
+    def __init__(self, ceilings=None, scale=1.0, rate=None):
+        self.ceilings = ceilings or Config.CRAWLER_RATE_CEILINGS
+        self.scale = scale
+        self.rate = rate
+        self.endpoints = {}
+        self._lock = threading.Lock()
+
+    def _endpoint(self, endpoint):
+        with self._lock:
+            if endpoint not in self.endpoints:
+                ceiling = self.ceilings[endpoint] * self.scale
+                self.endpoints[endpoint] = EndpointLimiter(ceiling,
+                                                           self.rate)
+            return self.endpoints[endpoint]
+
+    def acquire(self, endpoint):
+        self._endpoint(endpoint).acquire()
+
+    def record(self, endpoint, latency, healthy):
+        self._endpoint(endpoint).record(latency, healthy)
+
+    def rates(self):
+        return {endpoint: limiter.rate
+                for endpoint, limiter in sorted(self.endpoints.items())}
+
+
+_shared_limiter = None
+
+
+def shared_limiter():
+    """Limiter used by every Transport of this process by default"""
+    global _shared_limiter
+    if _shared_limiter is None:
+        _shared_limiter = AdaptiveRateLimiter()
+    return _shared_limiter
+
+
+def set_shared_limiter(limiter):
+    global _shared_limiter
+    _shared_limiter = limiter
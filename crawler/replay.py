@@ -0,0 +1,196 @@
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qsl, urlsplit, urlunsplit
+
+from config import Config
+from .transport import Transport
+
+
+def exchange_key(method, url, data):
+    """
+    Key of an upstream exchange. Host is left out, so that an exchange
+    recorded from plus.pl matches the same request sent to a replay server.
+    """
+    parts = urlsplit(url)
+    path = parts.path + ('?' + parts.query if parts.query else '')
+    form = sorted((str(name), str(value))
+                  for name, value in (data or {}).items())
+    return json.dumps([method.upper(), path, form])
+
+
+def _stock_code(url):
+    return dict(parse_qsl(urlsplit(url).query)).get('deviceStockCode')
+
+
+class Cassette:
+    """
+    Upstream responses (DEVICE_LIST, DEVICE_PRICES, DEVICE_AVAILABLE and
+    product pages) stored in one JSON file, keyed by exchange_key.
+
+    Which offer's product page gets requested depends on the order devices
+    were saved in, so a product page missing from the cassette is replayed
+    from a recorded page of the same sku under another offer.
+    """
+    def __init__(self, path=None):
+        self.path = path or Config.CRAWLER_CASSETTE
+        self.exchanges = {}
+        self.product_pages = {}
+        self._lock = threading.Lock()
+        if os.path.exists(self.path):
+            with open(self.path) as cassette:
+                self.exchanges = json.load(cassette)
+        for key, exchange in self.exchanges.items():
+            method, path, _ = json.loads(key)
+            self._index(method, path, exchange)
+
+    def _index(self, method, url, exchange):
+        stock_code = _stock_code(url)
+        if method == 'GET' and stock_code and exchange['status'] == 200:
+            self.product_pages.setdefault(stock_code, exchange)
+
+    def __len__(self):
+        return len(self.exchanges)
+
+    def record(self, method, url, data, status_code, content):
+        exchange = {
+            'status': status_code,
+            'body': content.decode('utf-8', 'surrogateescape')
+        }
+        with self._lock:
+            self.exchanges[exchange_key(method, url, data)] = exchange
+            self._index(method.upper(), url, exchange)
+
+    def play(self, method, url, data):
+        """:return: (status code, content) or None if never recorded"""
+        exchange = self.exchanges.get(exchange_key(method, url, data))
+        if exchange is None and method.upper() == 'GET':
+            exchange = self.product_pages.get(_stock_code(url))
+        if exchange is None:
+            return None
+        return exchange['status'], \
+            exchange['body'].encode('utf-8', 'surrogateescape')
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            with open(self.path, 'w') as cassette:
+                json.dump(self.exchanges, cassette, sort_keys=True)
+
+
+class RecordingTransport(Transport):
+    """Transport which also stores every final response in a cassette"""
+    def __init__(self, cassette, **kwargs):
+        super().__init__(**kwargs)
+        self.cassette = cassette
+
+    def request(self, method, url, data=None, decode=None):
+        if decode is None:
+            r = super().request(method, url, data=data)
+            self.cassette.record(method, url, data, r.status_code, r.content)
+            return r
+
+        def recording_decode(chunks):
+            body = []
+
+            def read():
+                for chunk in chunks:
+                    body.append(chunk)
+                    yield chunk
+            result = decode(read())
+            self.cassette.record(method, url, data, 200, b''.join(body))
+            return result
+        return super().request(method, url, data=data,
+                               decode=recording_decode)
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    def _reply(self, data):
+        server = self.server
+        time.sleep(server.latency + server.random.uniform(0, server.jitter))
+        if server.random.random() < server.error_rate:
+            status, content = 503, b''
+        else:
+            exchange = server.cassette.play(self.command, self.path, data)
+            if exchange is None:
+                with server.lock:
+                    server.misses += 1
+            status, content = exchange or (404, b'')
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        self._reply(None)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self._reply(dict(parse_qsl(body.decode('utf-8'),
+                                   keep_blank_values=True)))
+
+    def log_message(self, *args):
+        pass
+
+
+class ReplayServer(ThreadingMixIn, HTTPServer):
+    """
+    Local stand-in for plus.pl serving a cassette.
+
+    Every response is delayed by `latency` plus up to `jitter` seconds, and
+    a share of `error_rate` requests gets 503 instead. Requests which were
+    never recorded get 404 and are counted in `misses`.
+    """
+    daemon_threads = True
+
+    def __init__(self, cassette, latency=0.0, jitter=0.0, error_rate=0.0,
+                 seed=None):
+        super().__init__(('127.0.0.1', 0), ReplayHandler)
+        self.cassette = cassette
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.misses = 0
+        self.lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def netloc(self):
+        return '127.0.0.1:%d' % self.server_port
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self._thread.join()
+
+    def transport(self, **kwargs):
+        return ReplayTransport(self.netloc, **kwargs)
+
+
+class ReplayTransport(Transport):
+    """
+    Transport sending every request to a replay server instead of its
+    host. Retries, rate limits and per-endpoint stats still apply to the
+    original url.
+    """
+    def __init__(self, netloc, **kwargs):
+        super().__init__(**kwargs)
+        self.netloc = netloc
+
+    def _send(self, method, url, data, stream=False):
+        parts = urlsplit(url)
+        url = urlunsplit(('http', self.netloc, parts.path, parts.query, ''))
+        return super()._send(method, url, data, stream)
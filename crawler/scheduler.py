@@ -0,0 +1,238 @@
+import calendar
+import collections
+import datetime
+import json
+import os
+import time
+import traceback
+
+from app import db
+from app.models import Offer
+from config import Config
+from .workqueue import QueueCrawler
+
+
+def combo_key(segment, offer):
+    return '|'.join((segment, offer["contractConditionCode"],
+                     offer["tariffPlanCode"], offer["offerNSICode"]))
+
+
+def _timestamp(date):
+    return calendar.timegm(date.utctimetuple()) if date else 0
+
+
+class CrawlScheduler:
+    """
+    Long-running scheduler of targeted refreshes.
+
+    Every segment / contract condition / tariff / offer combination is
+    refreshed on its own, as often as it changes: its volatility is a
+    moving average of whether a refresh found any changed device, seeded
+    from offers whose old_price differs from price. A combination is due
+    `min_interval / volatility` seconds after its last refresh (seeded
+    from scrapping_date), but never sooner than `min_interval` nor later
+    than `max_interval`, so stable ones only get rare full passes. Offer
+    lists of segments are fetched again every `discovery_interval`.
+
+    Jobs run most overdue first while the requests of the last hour stay
+    within `budget`. State is kept in a JSON file between restarts.
+
+    Crawlers of segments live as long as the scheduler, while other
+    processes (crawls, workers, discovery) save offers too, so by default
+    they are QueueCrawlers, which look up offers of every page before
+    saving it.
+    """
+    SMOOTHING = 0.3
+
+    def __init__(self, segments, budget=None, min_interval=None,
+                 max_interval=None, discovery_interval=None,
+                 state_path=None, crawler_factory=None, clock=time.time):
+        self.segments = segments
+        self.budget = budget or Config.CRAWLER_SCHEDULER_BUDGET
+        self.min_interval = min_interval or \
+            Config.CRAWLER_SCHEDULER_MIN_INTERVAL
+        self.max_interval = max_interval or \
+            Config.CRAWLER_SCHEDULER_MAX_INTERVAL
+        self.discovery_interval = discovery_interval or \
+            Config.CRAWLER_SCHEDULER_DISCOVERY_INTERVAL
+        self.state_path = state_path or Config.CRAWLER_SCHEDULER_STATE
+        self.crawler_factory = crawler_factory or \
+            (lambda segment: QueueCrawler(segment, incremental=True))
+        self.clock = clock
+        self.combos = {}
+        self.discovered = {}
+        self.crawlers = {}
+        self.spent = collections.deque()
+        self.load()
+
+    def load(self):
+        if os.path.exists(self.state_path):
+            with open(self.state_path) as state:
+                state = json.load(state)
+            self.combos = state['combos']
+            self.discovered = state['discovered']
+
+    def save(self):
+        directory = os.path.dirname(self.state_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.state_path, 'w') as state:
+            json.dump({'combos': self.combos,
+                       'discovered': self.discovered}, state)
+
+    def interval(self, combo):
+        volatility = max(combo['volatility'],
+                         float(self.min_interval) / self.max_interval)
+        return min(self.max_interval, self.min_interval / volatility)
+
+    def requests_last_hour(self, now):
+        while self.spent and self.spent[0][0] <= now - 3600:
+            self.spent.popleft()
+        return sum(requests for _, requests in self.spent)
+
+    def due_jobs(self, now):
+        """
+        :return: (priority, estimated requests, kind, key) of due jobs,
+        most urgent first
+        """
+        jobs = []
+        for segment in self.segments:
+            discovered = self.discovered.get(segment)
+            if discovered is None or \
+                    now - discovered['at'] >= self.discovery_interval:
+                cost = discovered['requests'] if discovered else 3
+                jobs.append((float('inf'), cost, 'offers', segment))
+        for key, combo in self.combos.items():
+            overdue = (now - combo['refreshed_at']) / self.interval(combo)
+            if overdue >= 1:
+                jobs.append((overdue, combo['pages'], 'refresh', key))
+        jobs.sort(key=lambda job: job[0], reverse=True)
+        return jobs
+
+    def _seed(self, segment):
+        """
+        :return: (share of offers which changed price, last scrapping
+        time) by (contract condition, tariff, offer) of given segment
+        """
+        changed = db.func.sum(db.case(
+            [(db.and_(Offer.old_price.isnot(None),
+                      Offer.old_price != Offer.price), 1)], else_=0
+        ))
+        rows = db.session.query(
+            Offer.contract_condition_code, Offer.tariff_plan_code,
+            Offer.offer_code, db.func.count(Offer.id), changed,
+            db.func.max(Offer.scrapping_date)
+        ).filter(Offer.segmentation == segment).group_by(
+            Offer.contract_condition_code, Offer.tariff_plan_code,
+            Offer.offer_code
+        )
+        return {
+            '|'.join((segment, contract, tariff, offer_code)):
+                (float(changed or 0) / count, _timestamp(scrapped))
+            for contract, tariff, offer_code, count, changed, scrapped
+            in rows
+        }
+
+    def discover_offers(self, segment, now):
+        """
+        Fetches offer list of segment, starts tracking new offers and
+        deactivates offers no longer listed
+        """
+        crawler = self.crawlers[segment] = self.crawler_factory(segment)
+        offers = crawler.offer_list(crawler.available_contract_conditions())
+        seeds = self._seed(segment)
+        combos = {}
+        for offer in offers:
+            key = combo_key(segment, offer)
+            combo = self.combos.get(key)
+            if combo is None:
+                # offers never saved before are hot until refreshed
+                volatility, refreshed_at = seeds.get(key, (1.0, 0))
+                combo = {'segment': segment, 'volatility': volatility,
+                         'refreshed_at': refreshed_at, 'pages': 1}
+            combo['offer'] = offer
+            combos[key] = combo
+        for key in [key for key, combo in self.combos.items()
+                    if combo['segment'] == segment]:
+            dropped = self.combos.pop(key)
+            if key not in combos and 'offer' in dropped:
+                crawler.mark_inactive_offers(dropped['offer'])
+        self.combos.update(combos)
+        self.discovered[segment] = {'at': now,
+                                    'requests': crawler.request_counter}
+        return crawler.request_counter
+
+    def refresh(self, key, now):
+        """
+        Crawls all pages of one offer, records its price changes,
+        deactivates its devices no longer listed and updates its
+        volatility
+        """
+        combo = self.combos[key]
+        segment = combo['segment']
+        crawler = self.crawlers.get(segment)
+        if crawler is None:
+            crawler = self.crawlers[segment] = self.crawler_factory(segment)
+        crawler.scrapping_time = datetime.datetime.utcnow()
+        requests = crawler.request_counter
+        unchanged = crawler.unchanged_devices
+        devices = pages = 0
+        for _, page_devices in crawler.iter_device_pages(combo['offer']):
+            crawler.save_or_update_devices(page_devices, combo['offer'])
+            devices += len(page_devices)
+            pages += 1
+        crawler.save_price_history(combo['offer'])
+        crawler.mark_inactive_offers(combo['offer'])
+        changed = devices > crawler.unchanged_devices - unchanged
+        combo['volatility'] += self.SMOOTHING * (float(changed) -
+                                                 combo['volatility'])
+        combo['pages'] = max(pages, 1)
+        combo['refreshed_at'] = now
+        return crawler.request_counter - requests
+
+    def run_once(self):
+        """
+        Runs due jobs until the hourly budget is used up
+        :return: number of jobs run
+        """
+        now = self.clock()
+        ran = 0
+        for _, cost, kind, key in self.due_jobs(now):
+            if kind == 'refresh' and key not in self.combos:
+                # dropped from the offer list by an earlier job
+                continue
+            if self.requests_last_hour(now) + cost > self.budget:
+                break
+            try:
+                if kind == 'offers':
+                    requests = self.discover_offers(key, now)
+                else:
+                    requests = self.refresh(key, now)
+            except Exception:
+                db.session.rollback()
+                traceback.print_exc()
+                # identity map may hold rows of the failed save
+                self.crawlers.pop(key if kind == 'offers'
+                                  else self.combos[key]['segment'], None)
+                # retried after min_interval
+                if kind == 'offers':
+                    self.discovered[key] = {
+                        'at': now - self.discovery_interval +
+                        self.min_interval,
+                        'requests': cost
+                    }
+                else:
+                    self.combos[key]['refreshed_at'] = now
+                requests = cost
+            self.spent.append((now, requests))
+            ran += 1
+            now = self.clock()
+        if ran:
+            self.save()
+        return ran
+
+    def run_forever(self, poll=None):
+        poll = poll or Config.CRAWLER_SCHEDULER_POLL
+        while True:
+            if not self.run_once():
+                time.sleep(poll)
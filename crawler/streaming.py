@@ -0,0 +1,125 @@
+import codecs
+import json
+import re
+
+# fields of a device saving it reads, nested fields of nested objects
+DEVICE_FIELDS = ('brand', 'modelName', 'productType', 'sku', 'available',
+                 'devicePriority')
+PRICE_FIELDS = ('grossPrice',)
+PHOTO_FIELDS = ('normalImage', 'defaultImage')
+
+CHUNK_SIZE = 16 * 1024
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_decoder = json.JSONDecoder()
+
+
+def slim_device(device):
+    """:return: device with only the fields saving it reads"""
+    slim = {field: device[field] for field in DEVICE_FIELDS}
+    slim['prices'] = {field: device['prices'][field]
+                      for field in PRICE_FIELDS}
+    slim['imagesOnDetails'] = [
+        {field: photo[field] for field in PHOTO_FIELDS}
+        for photo in device['imagesOnDetails']
+    ]
+    return slim
+
+
+class _Buffer:
+    """Decoded text of a byte stream, read further only when needed"""
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.text = ''
+        self.pos = 0
+        self.finished = False
+
+    def more(self):
+        """Reads the next chunk, dropping text already consumed"""
+        for chunk in self.chunks:
+            text = self.decoder.decode(chunk)
+            if text:
+                self.text = self.text[self.pos:] + text
+                self.pos = 0
+                return True
+        if not self.finished:
+            self.finished = True
+            self.text = self.text[self.pos:] + \
+                self.decoder.decode(b'', final=True)
+            self.pos = 0
+        return False
+
+    def peek(self):
+        """:return: next non-whitespace character, '' at the end"""
+        while True:
+            self.pos = _WHITESPACE.match(self.text, self.pos).end()
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self.more():
+                return ''
+
+    def expect(self, characters):
+        character = self.peek()
+        if not character or character not in characters:
+            raise ValueError('Expecting one of %r at %d, got %r'
+                             % (characters, self.pos, character))
+        self.pos += 1
+        return character
+
+    def value(self):
+        """
+        Decodes the next JSON value. A value ending right at the end of
+        read text may go on in the next chunk (e.g. a number), so it is
+        decoded again with more text.
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.text, self.pos)
+            except ValueError:
+                if not self.more():
+                    raise
+                continue
+            if end < len(self.text) or not self.more():
+                self.pos = end
+                return value
+
+
+class JSONObjectStream:
+    """
+    Incremental decoder of a JSON object read chunk by chunk, e.g. from
+    response.iter_content().
+
+    Iterating yields (key, item) for every item of the object's top-level
+    arrays as soon as it is read; the stream itself holds only the item
+    being decoded, keeping earlier ones is up to the caller.
+    Other top-level members are decoded whole into `members`, which is
+    complete once iteration is over.
+    """
+    def __init__(self, chunks):
+        self.buffer = _Buffer(chunks)
+        self.members = {}
+
+    def __iter__(self):
+        buffer = self.buffer
+        buffer.expect('{')
+        if buffer.peek() == '}':
+            buffer.pos += 1
+            return
+        while True:
+            key = buffer.value()
+            buffer.expect(':')
+            if buffer.peek() == '[':
+                buffer.pos += 1
+                if buffer.peek() == ']':
+                    buffer.pos += 1
+                else:
+                    while True:
+                        yield key, buffer.value()
+                        if buffer.expect(',]') == ']':
+                            break
+            else:
+                self.members[key] = buffer.value()
+            if buffer.expect(',}') == '}':
+                return
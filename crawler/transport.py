@@ -0,0 +1,167 @@
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import Config
+from .metrics import LatencyHistogram
+from .ratelimit import shared_limiter
+from .streaming import CHUNK_SIZE
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# connection lost or timed out, also while reading a streamed body
+RETRY_ERRORS = (requests.ConnectionError, requests.Timeout,
+                requests.exceptions.ChunkedEncodingError)
+
+
+def endpoint_name(url):
+    for name in ('DEVICE_LIST', 'DEVICE_PRICES', 'DEVICE_AVAILABLE'):
+        if url == getattr(Config, name):
+            return name
+    return 'PRODUCT_PAGE'
+
+
+class EndpointStats:
+    def __init__(self):
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.seconds = 0.0
+        self.bytes = 0
+        self.latency = LatencyHistogram()
+
+    def to_json(self):
+        return {
+            'requests': self.requests,
+            'retries': self.retries,
+            'failures': self.failures,
+            'seconds': self.seconds,
+            'bytes': self.bytes,
+            'latency': self.latency.to_json()
+        }
+
+
+class _CountedChunks:
+    """Chunks of a streamed body, counting the bytes read"""
+    def __init__(self, response):
+        self.chunks = response.iter_content(CHUNK_SIZE)
+        self.size = 0
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            self.size += len(chunk)
+            yield chunk
+
+
+class Transport:
+    """
+    Keep-alive HTTP transport shared by all calls of a crawler.
+
+    Connections are pooled by one requests.Session. Connection errors,
+    timeouts (also while a streamed body is read) and 429/5xx responses
+    are retried with exponential backoff and full jitter. Every attempt waits for the rate limiter, which is
+    shared by all transports of the process unless given. Statistics are
+    kept per upstream endpoint.
+    """
+    def __init__(self, pool_size=None, timeout=None, retries=None,
+                 backoff=None, limiter=None):
+        self.pool_size = pool_size or Config.CRAWLER_POOL_SIZE
+        self.timeout = timeout or Config.CRAWLER_TIMEOUT
+        self.retries = Config.CRAWLER_RETRIES if retries is None else retries
+        self.backoff = Config.CRAWLER_BACKOFF if backoff is None else backoff
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.pool_size,
+                              pool_maxsize=self.pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.limiter = limiter or shared_limiter()
+        self.stats = {}
+        self._lock = threading.Lock()
+
+    def post(self, url, data, decode=None):
+        return self.request('POST', url, data=data, decode=decode)
+
+    def get(self, url):
+        return self.request('GET', url)
+
+    def _record(self, endpoint, seconds, retried=False, failed=False,
+                size=0):
+        self.limiter.record(endpoint, seconds, healthy=not failed)
+        with self._lock:
+            stats = self.stats.setdefault(endpoint, EndpointStats())
+            stats.requests += 1
+            stats.seconds += seconds
+            stats.bytes += size
+            stats.latency.add(seconds)
+            if retried:
+                stats.retries += 1
+            if failed:
+                stats.failures += 1
+
+    def _send(self, method, url, data, stream=False):
+        return self.session.request(method, url, data=data,
+                                    timeout=self.timeout, stream=stream)
+
+    def _sleep(self, attempt):
+        time.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+
+    def request(self, method, url, data=None, decode=None):
+        """
+        :param decode: reads the body of a successful response while it
+        streams in, given its chunks; its result is returned instead of
+        the response. Reading the body counts in the attempt's latency and
+        is retried like the request itself.
+        """
+        endpoint = endpoint_name(url)
+        for attempt in range(self.retries + 1):
+            last_attempt = attempt == self.retries
+            self.limiter.acquire(endpoint)
+            start = time.time()
+            r = chunks = None
+            read = False
+            try:
+                r = self._send(method, url, data, stream=decode is not None)
+                failed = r.status_code in RETRY_STATUSES
+                if decode is None or failed:
+                    result, size = r, len(r.content)
+                else:
+                    chunks = _CountedChunks(r)
+                    result = decode(chunks)
+                    # what decode left of the body, e.g. a trailing newline
+                    for _ in chunks:
+                        pass
+                    size = chunks.size
+                read = True
+            except RETRY_ERRORS:
+                self._record(endpoint, time.time() - start,
+                             retried=attempt > 0, failed=True,
+                             size=chunks.size if chunks else 0)
+                if last_attempt:
+                    raise
+            else:
+                self._record(endpoint, time.time() - start,
+                             retried=attempt > 0, failed=failed, size=size)
+                if not failed:
+                    return result
+                if last_attempt:
+                    r.raise_for_status()
+            finally:
+                if decode is not None and r is not None:
+                    if read:
+                        r.close()
+                    else:
+                        # rest of the body may still come, so the
+                        # connection is dropped instead of going back to
+                        # the pool
+                        r.raw.close()
+            self._sleep(attempt)
+
+    def summary(self):
+        rates = self.limiter.rates()
+        summary = {}
+        for endpoint, stats in sorted(self.stats.items()):
+            summary[endpoint] = stats.to_json()
+            summary[endpoint]['rate'] = rates.get(endpoint)
+        return summary
@@ -1,193 +1,483 @@
 import datetime
+import functools
+import hashlib
 import json
-import requests
-from bs4 import BeautifulSoup as Soup
+import threading
+from sqlalchemy.orm.attributes import set_committed_value
 
 from app import db
-from app.models import Offer, Photo, Product, SKU
+from app.models import Offer, Photo, PriceChange, Product, SKU
 from config import Config
+from .discovery import discover_new_skus
+from .extraction import extract_photo_urls, extract_skus
+from .identity import IdentityMap
+from .metrics import StageTimer, write_metrics
+from .pipeline import crawl_pipeline
+from .streaming import JSONObjectStream, slim_device
+from .transport import Transport
+
+
+def device_fingerprint(device_info, offer_info):
+    """
+    Compact digest of everything saving a device writes: prices,
+    availability, priority and photos
+    """
+    content = [
+        device_info["prices"]["grossPrice"],
+        offer_info["monthlyFeeGross"],
+        device_info["available"],
+        device_info["devicePriority"],
+        sorted((photo["normalImage"], str(photo["defaultImage"]))
+               for photo in device_info["imagesOnDetails"])
+    ]
+    digest = hashlib.sha1(json.dumps(content).encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+def device_key(device_info):
+    """Device-level data of device, the same under every offer"""
+    return (
+        device_info["brand"], device_info["modelName"],
+        device_info["productType"], device_info["available"],
+        tuple((photo["normalImage"], photo["defaultImage"])
+              for photo in device_info["imagesOnDetails"])
+    )
 
 
 class WebCrawler:
-    def __init__(self, segment):
+    def __init__(self, segment, transport=None, cache=None,
+                 incremental=False, frontier=None):
+        """
+        :param incremental: devices with the same fingerprint as in the
+        previous crawl only get their offer's scrapping date bumped
+        :param frontier: checkpoint.Frontier; device pages it has as done
+        are not fetched again and its crawl start is the scrapping time
+        """
         self.segment = segment
+        self.transport = transport or Transport()
+        self.cache = cache
+        self.frontier = frontier
+        self.identity = IdentityMap(segment)
+        self.incremental = incremental
+        self.unchanged_devices = 0
+        self.synced_devices = {}
+        self.duplicate_devices = 0
         self.request_counter = 0
+        self.stages = StageTimer()
+        self._counter_lock = threading.Lock()
         self.scrapping_time = datetime.datetime.utcnow()
+        if frontier is not None and frontier.scrapping_time is not None:
+            self.scrapping_time = frontier.scrapping_time
+
+    def _count_request(self):
+        with self._counter_lock:
+            self.request_counter += 1
+
+    def _post(self, url, data, cacheable=False):
+        """
+        :param cacheable: response holds no prices nor availability, nor
+        anything else a crawl saves, so it may be served from response cache
+        """
+        cacheable = cacheable and self.cache is not None
+        if cacheable:
+            r = self.cache.get(url, data)
+            if r is not None:
+                return r
+        with self.stages.stage('fetch'):
+            r = self.transport.post(url, data=data)
+        self._count_request()
+        if cacheable:
+            self.cache.set(url, data, r)
+        return r
+
+    def _get(self, url):
+        with self.stages.stage('fetch'):
+            r = self.transport.get(url)
+        self._count_request()
+        return r
+
+    def _json(self, r):
+        with self.stages.stage('parse'):
+            return r.json()
+
+    def _stream(self, url, data, key, slim=None):
+        """
+        Posts to DEVICE_LIST and decodes the response while its body
+        streams in, one item of its top-level arrays at a time, so neither
+        the whole body nor a page of devices with all their fields is held
+        in memory. The returned list holds only the items once slimmed.
+        The body is read within the transport's retries and timing, so
+        reading it counts as fetching. Never cached.
+        :param slim: applied to every item as soon as it is decoded
+        :return: list of items of top-level array `key`, and other
+        top-level members
+        """
+        def decode(chunks):
+            stream = JSONObjectStream(chunks)
+            items = [slim(item) if slim else item
+                     for name, item in stream if name == key]
+            return items, stream.members
+        with self.stages.stage('fetch'):
+            decoded = self.transport.post(url, data=data, decode=decode)
+        self._count_request()
+        return decoded
 
     def available_contract_conditions(self):
         contract_conditions = []
-        r = requests.post(Config.DEVICE_LIST,
-                          data={"processSegmentationCode": self.segment})
-        self.request_counter += 1
-        devices_json = r.json()
+        r = self._post(Config.DEVICE_LIST,
+                       data={"processSegmentationCode": self.segment},
+                       cacheable=True)
+        devices_json = self._json(r)
         available_cc = devices_json['pageInfo']['availableContractConditions']
         for cc in available_cc:
             contract_conditions.append(cc["value"].split()[0] + "A")
         return contract_conditions
 
-    def offer_list(self, contract_conditions):
-        offers = []
+    def iter_offers(self, contract_conditions):
+        """Yields offers of every contract condition as they are fetched"""
         for contract_condition in contract_conditions:
-            r = requests.post(
+            offers, _ = self._stream(
                 Config.DEVICE_LIST,
                 data={
                     "processSegmentationCode": self.segment,
                     "contractConditionCode": contract_condition
-                }
+                },
+                key='rotator'
             )
-            self.request_counter += 1
-            devices_json = r.json()
-            offers.extend(devices_json['rotator'])
-        return offers
+            for offer in offers:
+                yield offer
+
+    def offer_list(self, contract_conditions):
+        return list(self.iter_offers(contract_conditions))
 
-    def mark_inactive_offers(self, offer_codes_list):
+    def mark_inactive_offers(self, offer_info=None):
         """
-        :param offer_list: list of scrapped offer codes in segmentation
+        Deactivates offers of segment not saved nor pinged by this crawl,
+        with one UPDATE. Offers never crawled (e.g. copied by discovery)
+        have no scrapping date. Call only after every offer of segment was
+        crawled, or every page of `offer_info`.
+        :param offer_info: only offers of this offer from the offer list
+        :return: number of deactivated offers
         """
-        for offer in Offer.query.filter_by(segmentation=self.segment).all():
-            if offer.offer_code not in offer_codes_list:
-                offer.is_active = False
-                db.session.add(offer)
+        query = Offer.query.filter(
+            Offer.segmentation == self.segment,
+            db.or_(Offer.scrapping_date < self.scrapping_time,
+                   Offer.scrapping_date.is_(None)),
+            Offer.is_active.isnot(False)
+        )
+        if offer_info is not None:
+            query = query.filter(
+                Offer.offer_code == offer_info["offerNSICode"],
+                Offer.tariff_plan_code == offer_info["tariffPlanCode"],
+                Offer.contract_condition_code ==
+                offer_info["contractConditionCode"]
+            )
+        deactivated = query.update({Offer.is_active: False},
+                                   synchronize_session=False)
         db.session.commit()
+        return deactivated
+
+    def save_price_history(self, offer_info=None, commit=True):
+        """
+        Records price changes of offers saved or pinged by this crawl in
+        bulk, see PriceChange.record_changes
+        :param offer_info: only offers of this offer from the offer list
+        :param commit: if False, left for the caller to commit
+        :return: number of recorded changes
+        """
+        db.session.flush()
+        recorded = PriceChange.record_changes(self.segment,
+                                              self.scrapping_time, offer_info)
+        if commit:
+            db.session.commit()
+        return recorded
 
     def pages(self, offer):
         """
         param: offer - one offer from offer list scrapped by offer_list method
         """
-        r = requests.post(
+        r = self._post(
             Config.DEVICE_LIST,
             data={"processSegmentation": self.segment,
                   "offerNSICode": offer["offerNSICode"],
                   "tariffPlanCode": offer["tariffPlanCode"],
-                  "contractConditionCode": offer["contractConditionCode"]}
+                  "contractConditionCode": offer["contractConditionCode"]},
+            cacheable=True
         )
-        self.request_counter += 1
-        offer_json = r.json()
+        offer_json = self._json(r)
         return offer_json['pageInfo']['pages']
 
-    def gather_devices(self, offer, page):
-        r = requests.post(
+    def _device_page(self, offer, page):
+        """
+        :return: DEVICE_LIST response with one page of devices, which hold
+        only the fields saving them reads
+        """
+        devices, devices_json = self._stream(
             Config.DEVICE_LIST,
             data={"processSegmentation": self.segment,
                   "offerNSICode": offer["offerNSICode"],
                   "tariffPlanCode": offer["tariffPlanCode"],
                   "contractConditionCode": offer["contractConditionCode"],
-                  "page": page}
+                  "page": page},
+            key='devices', slim=slim_device
         )
-        self.request_counter += 1
-        devices_json = r.json()
-        return devices_json["devices"]
+        devices_json['devices'] = devices
+        return devices_json
+
+    def gather_devices(self, offer, page):
+        return self._device_page(offer, page)["devices"]
+
+    def iter_device_pages(self, offer, executor=None):
+        """
+        Yields (page, devices) for every page of offer. Page count comes
+        with the first page, so there is no separate pages() request.
+        :param executor: if given, pages after the first one are fetched
+        concurrently with it
+        """
+        frontier = self.frontier
+        pages = frontier.pages(offer) if frontier else None
+        if pages is None or not frontier.is_page_done(offer, 1):
+            first_page = self._device_page(offer, 1)
+            pages = first_page['pageInfo']['pages']
+            if frontier:
+                frontier.set_pages(offer, pages)
+            yield 1, first_page["devices"]
+        remaining_pages = [
+            page for page in range(2, pages + 1)
+            if not (frontier and frontier.is_page_done(offer, page))
+        ]
+        if executor is None:
+            devices = (self.gather_devices(offer, page)
+                       for page in remaining_pages)
+        else:
+            devices = executor.map(functools.partial(self.gather_devices,
+                                                     offer), remaining_pages)
+        for page, page_devices in zip(remaining_pages, devices):
+            yield page, page_devices
 
     def _all_skus(self, product_url):
         """
         Slow. Many requests. Use only when necessary
         Find all skus for given product url
         """
-        r = requests.get(url=product_url)
-        self.request_counter += 1
-        html = r.content
-        parsed_html = Soup(html)
-        skus = parsed_html.find_all('input', attrs={'name': 'color'})
-        return [sku['device-skus'] for sku in skus]
+        r = self._get(product_url)
+        with self.stages.stage('parse'):
+            return extract_skus(r.content)
+
+    def _photo_urls(self, offer_url):
+        r = self._get(offer_url)
+        with self.stages.stage('parse'):
+            return extract_photo_urls(r.content)
 
     def find_all_photos(self, offer):
-        r = requests.get(url=offer.offer_url)
-        self.request_counter += 1
-        html = r.content
-        parsed_html = Soup(html)
-        photo_container = parsed_html.find('div',
-                                           attrs={'id': 'phone-carousel'})
-        imgs = photo_container.find_all('img')
-        main_photo = Photo(sku=offer.sku, url=imgs[0].attrs['src'],
-                           default=True)
+        urls = self._photo_urls(offer.offer_url)
+        main_photo = Photo(sku=offer.sku, url=urls[0], default=True)
         db.session.add(main_photo)
-        for img in imgs[1:]:
-            photo = Photo(sku=offer.sku, url=img.attrs['src'], default=False)
+        for url in urls[1:]:
+            photo = Photo(sku=offer.sku, url=url, default=False)
             db.session.add(photo)
         db.session.commit()
 
     def save_or_update_device(self, device_info, offer_info):
+        self.save_or_update_devices([device_info], offer_info)
+
+    def _resolve_rows(self, devices):
+        """
+        Makes sure identity map knows every row already saved for given
+        devices. Rows missing from the map may have been saved by somebody
+        else in the meantime, so they are looked up with one query per model.
+        Offers of the segment are all preloaded and only this crawl saves
+        them, so missing offers are simply new.
+        """
+        identity = self.identity
+        if not identity.loaded:
+            identity.preload()
+        products = identity.missing(
+            'products',
+            {(device["brand"], device["modelName"]) for device in devices}
+        )
+        if products:
+            for product in Product.query.filter(Product.model_name.in_(
+                    {model_name for _, model_name in products})):
+                key = (product.manufacturer, product.model_name)
+                if key in products:
+                    identity.add('products', key, product)
+        stock_codes = identity.missing(
+            'skus', {device["sku"] for device in devices}
+        )
+        if stock_codes:
+            for sku in SKU.query.filter(SKU.stock_code.in_(stock_codes)):
+                identity.add('skus', sku.stock_code, sku)
+        urls = identity.missing(
+            'photos', {photo["normalImage"] for device in devices
+                       for photo in device["imagesOnDetails"]}
+        )
+        if urls:
+            for photo in Photo.query.filter(Photo.url.in_(urls)):
+                identity.add('photos', photo.url, photo)
+
+    def _commit_keeping_rows(self):
+        """
+        Commits without expiring rows held by identity map, so using them
+        later does not reload them from database one by one
+        """
+        session = db.session()
+        expire_on_commit = session.expire_on_commit
+        session.expire_on_commit = False
+        try:
+            session.commit()
+        finally:
+            session.expire_on_commit = expire_on_commit
+
+    def save_or_update_devices(self, devices, offer_info, commit=True):
+        """
+        Saves one page of devices scrapped for given offer in one transaction
+        :param commit: if False, the transaction is left for the caller to
+        commit, e.g. together with its own changes
+        """
+        if not devices:
+            return
+        with self.stages.stage('db'):
+            self._save_devices(devices, offer_info, commit)
+
+    def _sync_device(self, device_info):
+        """
+        Saves product, sku and photos of device. The same device comes
+        with every offer it is sold in, so this is done once per sku and
+        crawl, unless its device-level data changed in the meantime.
+        :return: sku of device
+        """
+        identity = self.identity
+        key = device_key(device_info)
+        if self.synced_devices.get(device_info["sku"]) == key:
+            self.duplicate_devices += 1
+            return identity.get('skus', device_info["sku"])
+
         # =================== Product ======================= #
-        product = Product.query.filter_by(
-            manufacturer=device_info["brand"],
-            model_name=device_info["modelName"]
-        ).first()
+        product_key = (device_info["brand"], device_info["modelName"])
+        product = identity.get('products', product_key)
         if not product:
             product = Product(
                 manufacturer=device_info["brand"],
                 model_name=device_info["modelName"],
                 product_type=device_info["productType"]
             )
+            identity.add('products', product_key, product)
 
         # =================== SKU ======================= #
-        sku = SKU.query.filter_by(stock_code=device_info["sku"]).first()
+        sku = identity.get('skus', device_info["sku"])
         if not sku:
             sku = SKU(base_product=product, stock_code=device_info["sku"])
+            identity.add('skus', sku.stock_code, sku)
         sku.availability = device_info["available"]
         # =================== Photo ======================= #
         for photo in device_info["imagesOnDetails"]:
-            device_photo = Photo.query.filter_by(
-                url=photo["normalImage"]).first()
+            device_photo = identity.get('photos', photo["normalImage"])
             if device_photo is not None:
                 device_photo.default = photo["defaultImage"]
             else:
                 device_photo = Photo(sku=sku, url=photo["normalImage"],
                                      default=photo["defaultImage"])
+                identity.add('photos', device_photo.url, device_photo)
             db.session.add(device_photo)
+        db.session.add(product)
+        db.session.add(sku)
+        self.synced_devices[sku.stock_code] = key
+        return sku
 
-        # =================== Offer ======================= #
-        offer = Offer.query.filter_by(
-            segmentation=self.segment,
-            offer_code=offer_info["offerNSICode"],
-            sku=sku,
-            tariff_plan_code=offer_info["tariffPlanCode"],
-            contract_condition_code=offer_info["contractConditionCode"]
-        ).first()
-        if not offer:
-            offer = Offer(
-                segmentation=self.segment,
-                market=self.segment.split(".")[0],
-                sku=sku,
-                offer_code=offer_info["offerNSICode"],
-                tariff_plan_code=offer_info["tariffPlanCode"],
-                contract_condition_code=offer_info["contractConditionCode"]
+    def _save_devices(self, devices, offer_info, commit=True):
+        identity = self.identity
+        self._resolve_rows(devices)
+        identity.missing('offers', {
+            identity.offer_key(offer_info, device["sku"])
+            for device in devices
+        })
+        abo_price = float(offer_info["monthlyFeeGross"].replace(",", "."))
+        unchanged_offers = []
+        for device_info in devices:
+            fingerprint = device_fingerprint(device_info, offer_info)
+            if self.incremental:
+                offer_key = identity.offer_key(offer_info, device_info["sku"])
+                offer = identity.get('offers', offer_key)
+                if offer is not None and offer.fingerprint == fingerprint:
+                    unchanged_offers.append(offer)
+                    continue
+
+            sku = self._sync_device(device_info)
+
+            # =================== Offer ======================= #
+            offer_key = identity.offer_key(offer_info, sku.stock_code)
+            offer = identity.get('offers', offer_key)
+            if not offer:
+                offer = Offer(
+                    segmentation=self.segment,
+                    market=self.segment.split(".")[0],
+                    sku=sku,
+                    offer_code=offer_info["offerNSICode"],
+                    tariff_plan_code=offer_info["tariffPlanCode"],
+                    contract_condition_code=offer_info["contractConditionCode"]
+                )
+                identity.add('offers', offer_key, offer)
+            offer.set_prices(
+                float(device_info["prices"]["grossPrice"].replace(",", "."))
             )
-        offer.set_prices(
-            float(device_info["prices"]["grossPrice"].replace(",", "."))
-        )
-        offer.abo_price = float(offer_info["monthlyFeeGross"].replace(",", "."))
-        offer.priority = device_info["devicePriority"]
+            offer.abo_price = abo_price
+            offer.priority = device_info["devicePriority"]
+            offer.fingerprint = fingerprint
+            offer.ping(self.scrapping_time)
 
         # =================== Saving ======================= #
-        db.session.add(product)
-        db.session.add(sku)
-        offer.ping(self.scrapping_time)
-        db.session.commit()
+        if unchanged_offers:
+            self._ping_unchanged(unchanged_offers)
+        if commit:
+            self._commit_keeping_rows()
+        else:
+            db.session.flush()
+
+    def _ping_unchanged(self, offers):
+        """Bumps scrapping date of unchanged offers with one UPDATE"""
+        Offer.query.filter(
+            Offer.id.in_([offer.id for offer in offers])
+        ).update({Offer.scrapping_date: self.scrapping_time,
+                  Offer.is_active: True},
+                 synchronize_session=False)
+        for offer in offers:
+            set_committed_value(offer, 'scrapping_date', self.scrapping_time)
+            set_committed_value(offer, 'is_active', True)
+        self.unchanged_devices += len(offers)
+
+    def _has_prices(self, offer, stock_code):
+        """Checks if sku is offered with the same codes as given offer"""
+        r = self._post(
+            Config.DEVICE_PRICES,
+            data={"processSegmentationCode": offer.segmentation,
+                  "deviceStockCode": stock_code,
+                  "offerNSICode": offer.offer_code,
+                  "tariffPlanCode": offer.tariff_plan_code,
+                  "contractConditionCode": offer.contract_condition_code},
+            cacheable=True
+        )
+        return bool(self._json(r)["devicesPrices"])
+
+    @staticmethod
+    def _copy_offer(offer, sku):
+        new_offer = Offer(
+            segmentation=offer.segmentation,
+            market=offer.market,
+            contract_condition_code=offer.contract_condition_code,
+            sku=sku,
+            tariff_plan_code=offer.tariff_plan_code,
+            offer_code=offer.offer_code
+        )
+        new_offer.priority = offer.priority
+        new_offer.set_prices(offer.price)
+        new_offer.abo_price = offer.abo_price
+        return new_offer
 
     def _create_offers_with_new_sku(self, offer_list, sku):
         for offer in offer_list:
-            r = requests.post(
-                url=Config.DEVICE_PRICES,
-                data={"processSegmentationCode": offer.segmentation,
-                      "deviceStockCode": sku.stock_code,
-                      "offerNSICode": offer.offer_code,
-                      "tariffPlanCode": offer.tariff_plan_code,
-                      "contractConditionCode": offer.contract_condition_code}
-            )
-            self.request_counter += 1
-            if r.json()["devicesPrices"]:
-                new_offer = Offer(
-                    segmentation=offer.segmentation,
-                    market=offer.market,
-                    contract_condition_code=offer.contract_condition_code,
-                    sku=sku,
-                    tariff_plan_code=offer.tariff_plan_code,
-                    offer_code=offer.offer_code
-                )
-                new_offer.priority = offer.priority
-                new_offer.set_prices(offer.price)
-                new_offer.abo_price = offer.abo_price
-                db.session.add(new_offer)
+            if self._has_prices(offer, sku.stock_code):
+                db.session.add(self._copy_offer(offer, sku))
         db.session.commit()
 
     def save_new_found_skus(self):
@@ -206,11 +496,23 @@ class WebCrawler:
                     db.session.add(sku)
         db.session.commit()
 
+    def crawl_devices(self):
+        """
+        Saves every device offered in segment, records price changes and
+        deactivates offers no longer offered
+        """
+        crawl_pipeline(self)
+        self.save_price_history()
+        self.mark_inactive_offers()
+
+    def crawl(self):
+        self.crawl_devices()
+        discover_new_skus(self)
+
     def check_availability(self, sku_stock_code):
-        r = requests.post(url=Config.DEVICE_AVAILABLE,
-                          data={"deviceStockCode": sku_stock_code})
-        self.request_counter += 1
-        return r.json()["deviceAvailables"][0]["available"]
+        r = self._post(Config.DEVICE_AVAILABLE,
+                       data={"deviceStockCode": sku_stock_code})
+        return self._json(r)["deviceAvailables"][0]["available"]
 
     def update_availability(self):
         """Used in a daily availability check"""
@@ -219,9 +521,6 @@ class WebCrawler:
             db.session.add(sku)
         db.session.commit()
 
-    def save_request_counter(self):
-        with open("logs/request_counter.txt", "a") as request_counter:
-            now = str(datetime.datetime.now())
-            segment = self.segment
-            req = self.request_counter
-            request_counter.write("\n%s; %s; %d" % (now, segment, req))
+    def save_metrics(self):
+        """Appends crawl metrics to Config.CRAWLER_METRICS_FILE"""
+        write_metrics(self)
@@ -0,0 +1,370 @@
+import datetime
+import json
+import os
+import socket
+import threading
+import time
+import traceback
+
+from sqlalchemy import text
+
+from app import db
+from app.models import CrawlUnit, Offer, SKU
+from config import Config
+from .discovery import discover_new_skus
+from .web_crawler import WebCrawler
+
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def _unit(kind, segment, payload):
+    return CrawlUnit(kind=kind, segmentation=segment,
+                     payload=json.dumps(payload, sort_keys=True),
+                     status=PENDING, attempts=0,
+                     created_at=datetime.datetime.utcnow())
+
+
+def enqueue_crawl(segments):
+    """
+    Queues fetching offer lists of segments. Workers queue a unit for
+    every page of every offer from there, and one finalizing the crawl of
+    each segment.
+    :return: number of queued units
+    """
+    scrapping_time = datetime.datetime.utcnow().strftime(TIME_FORMAT)
+    db.session.add_all([_unit('offers', segment, {'crawl': scrapping_time})
+                        for segment in segments])
+    db.session.commit()
+    return len(segments)
+
+
+def enqueue_discovery(batch_size=None):
+    """
+    Queues new sku discovery of every product with offers, `batch_size`
+    products per unit
+    :return: number of queued units
+    """
+    batch_size = batch_size or Config.CRAWLER_DISCOVERY_BATCH
+    product_ids = [
+        product_id for product_id, in db.session.query(SKU.base_product_id)
+        .join(Offer, Offer.sku_id == SKU.id).distinct()
+        .order_by(SKU.base_product_id)
+    ]
+    units = [_unit('discovery', None,
+                   {'product_ids': product_ids[i:i + batch_size]})
+             for i in range(0, len(product_ids), batch_size)]
+    db.session.add_all(units)
+    db.session.commit()
+    return len(units)
+
+
+class WorkQueue:
+    """
+    Crawl units in the crawl_units table, leased by workers for
+    `lease_seconds` and kept by heartbeats. Leases of dead workers expire
+    and their units are issued again, `max_attempts` times at most.
+
+    On Postgres free units are picked with FOR UPDATE SKIP LOCKED, so
+    workers never wait for each other. SQLite has no row locks, so there
+    every unit is claimed with a conditional UPDATE only one worker wins.
+    """
+    def __init__(self, worker_id=None, lease_seconds=None,
+                 max_attempts=None):
+        self.worker_id = worker_id or '%s:%d' % (socket.gethostname(),
+                                                 os.getpid())
+        self.lease_seconds = lease_seconds or Config.CRAWLER_LEASE_SECONDS
+        self.max_attempts = max_attempts or Config.CRAWLER_MAX_ATTEMPTS
+
+    def _expires(self):
+        return datetime.datetime.utcnow() + \
+            datetime.timedelta(seconds=self.lease_seconds)
+
+    @staticmethod
+    def _available(now):
+        # 'finalize' units wait for every unit crawling their segment
+        crawling = db.aliased(CrawlUnit)
+        waiting = db.and_(CrawlUnit.kind == 'finalize', db.exists().where(
+            db.and_(crawling.segmentation == CrawlUnit.segmentation,
+                    crawling.kind.in_(['offers', 'page']),
+                    crawling.status.in_([PENDING, LEASED]))
+        ))
+        return db.and_(
+            db.or_(CrawlUnit.status == PENDING,
+                   db.and_(CrawlUnit.status == LEASED,
+                           CrawlUnit.lease_expires < now)),
+            ~waiting
+        )
+
+    def _held(self, unit_ids):
+        return db.and_(CrawlUnit.id.in_(unit_ids),
+                       CrawlUnit.status == LEASED,
+                       CrawlUnit.leased_by == self.worker_id)
+
+    def lease(self, limit=None):
+        """:return: up to `limit` units leased to this worker"""
+        limit = limit or Config.CRAWLER_LEASE_BATCH
+        now = datetime.datetime.utcnow()
+        claim = {CrawlUnit.status: LEASED,
+                 CrawlUnit.leased_by: self.worker_id,
+                 CrawlUnit.lease_expires: self._expires(),
+                 CrawlUnit.attempts: CrawlUnit.attempts + 1}
+        # units whose workers kept dying on them are given up
+        CrawlUnit.query.filter(
+            CrawlUnit.status == LEASED, CrawlUnit.lease_expires < now,
+            CrawlUnit.attempts >= self.max_attempts
+        ).update({CrawlUnit.status: FAILED}, synchronize_session=False)
+        if db.engine.dialect.name == 'postgresql':
+            unit_ids = [unit_id for unit_id, in db.session.execute(text(
+                "SELECT id FROM crawl_units WHERE (status = :pending "
+                "OR (status = :leased AND lease_expires < :now)) "
+                "AND NOT (kind = 'finalize' AND EXISTS ("
+                "SELECT 1 FROM crawl_units crawling "
+                "WHERE crawling.segmentation = crawl_units.segmentation "
+                "AND crawling.kind IN ('offers', 'page') "
+                "AND crawling.status IN (:pending, :leased))) "
+                "ORDER BY id LIMIT :limit FOR UPDATE SKIP LOCKED"
+            ), {'pending': PENDING, 'leased': LEASED, 'now': now,
+                'limit': limit})]
+            if unit_ids:
+                CrawlUnit.query.filter(CrawlUnit.id.in_(unit_ids)).update(
+                    claim, synchronize_session=False)
+        else:
+            unit_ids = []
+            candidates = db.session.query(CrawlUnit.id) \
+                .filter(self._available(now)).order_by(CrawlUnit.id) \
+                .limit(limit * 4).all()
+            for unit_id, in candidates:
+                claimed = CrawlUnit.query.filter(
+                    CrawlUnit.id == unit_id, self._available(now)
+                ).update(claim, synchronize_session=False)
+                if claimed:
+                    unit_ids.append(unit_id)
+                    if len(unit_ids) == limit:
+                        break
+        db.session.commit()
+        if not unit_ids:
+            return []
+        return CrawlUnit.query.filter(CrawlUnit.id.in_(unit_ids)) \
+            .order_by(CrawlUnit.id).all()
+
+    def heartbeat(self, unit_ids, engine=None):
+        """
+        Extends leases this worker still holds
+        :param engine: used instead of db.session, e.g. from another thread
+        :return: number of extended leases
+        """
+        statement = CrawlUnit.__table__.update() \
+            .where(self._held(unit_ids)) \
+            .values(lease_expires=self._expires())
+        if engine is not None:
+            return engine.execute(statement).rowcount
+        rowcount = db.session.execute(statement).rowcount
+        db.session.commit()
+        return rowcount
+
+    def finish(self, unit):
+        """
+        Marks unit done in the current transaction, so it is committed
+        together with the unit's results
+        :return: False if the lease was lost to another worker
+        """
+        return bool(CrawlUnit.query.filter(self._held([unit.id])).update(
+            {CrawlUnit.status: DONE,
+             CrawlUnit.finished_at: datetime.datetime.utcnow()},
+            synchronize_session=False
+        ))
+
+    def fail(self, unit):
+        """Gives unit back to the queue, or up after `max_attempts`"""
+        db.session.rollback()
+        status = FAILED if unit.attempts >= self.max_attempts else PENDING
+        CrawlUnit.query.filter(self._held([unit.id])).update(
+            {CrawlUnit.status: status, CrawlUnit.leased_by: None},
+            synchronize_session=False
+        )
+        db.session.commit()
+
+    @staticmethod
+    def unfinished():
+        """:return: number of units pending or being processed"""
+        return CrawlUnit.query.filter(
+            CrawlUnit.status.in_([PENDING, LEASED])).count()
+
+    @staticmethod
+    def counts():
+        return dict(db.session.query(CrawlUnit.status,
+                                     db.func.count(CrawlUnit.id))
+                    .group_by(CrawlUnit.status))
+
+
+class QueueCrawler(WebCrawler):
+    """
+    Crawler used by a crawl worker, and by the crawl scheduler.
+
+    Workers on other nodes save offers of the same segment, so offers of
+    every page are looked up before saving instead of relying on the
+    preloaded identity map. They also share products and skus, so on
+    Postgres saving a page takes an advisory lock held until commit; on
+    SQLite the worker already holds the database write lock by then.
+    """
+    WRITE_LOCK = 7382
+
+    def save_or_update_devices(self, devices, offer_info, commit=True):
+        if not devices:
+            return
+        if db.engine.dialect.name == 'postgresql':
+            db.session.execute(text('SELECT pg_advisory_xact_lock(:key)'),
+                               {'key': self.WRITE_LOCK})
+        offers = db.session.query(Offer, SKU.stock_code) \
+            .join(SKU, Offer.sku_id == SKU.id).filter(
+                Offer.segmentation == self.segment,
+                Offer.offer_code == offer_info["offerNSICode"],
+                Offer.tariff_plan_code == offer_info["tariffPlanCode"],
+                Offer.contract_condition_code ==
+                offer_info["contractConditionCode"]
+            )
+        for offer, stock_code in offers:
+            self.identity.add('offers',
+                              self.identity.offer_key(offer_info, stock_code),
+                              offer)
+        super().save_or_update_devices(devices, offer_info, commit)
+
+
+class _Heartbeat(threading.Thread):
+    def __init__(self, queue, engine):
+        super().__init__(daemon=True)
+        self.queue = queue
+        self.engine = engine
+        self.unit_ids = frozenset()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.queue.lease_seconds / 3.0):
+            unit_ids = self.unit_ids
+            if not unit_ids:
+                continue
+            try:
+                self.queue.heartbeat(list(unit_ids), self.engine)
+            except Exception:
+                # leases outlive a few missed beats, so keep beating
+                traceback.print_exc()
+
+
+class CrawlWorker:
+    """
+    Leases units from the queue and processes them:
+    'offers' queue a 'page' unit for the first page of every offer of a
+    segment and a 'finalize' unit, 'page' saves one page of devices and
+    records its offer's price changes (the first one also queues the
+    remaining pages), 'finalize' deactivates offers of the segment the
+    crawl did not see once all its pages are done, and 'discovery'
+    searches new skus of a batch of products. A unit is marked done in
+    the transaction saving its results.
+    """
+    def __init__(self, queue=None, crawler_factory=None, poll=None):
+        self.queue = queue or WorkQueue()
+        self.crawler_factory = crawler_factory or \
+            (lambda segment: QueueCrawler(segment, incremental=True))
+        self.poll = poll or Config.CRAWLER_WORKER_POLL
+        self.crawlers = {}
+        self.processed = 0
+        self.failed = 0
+
+    def crawler(self, segment):
+        if segment not in self.crawlers:
+            self.crawlers[segment] = self.crawler_factory(segment)
+        return self.crawlers[segment]
+
+    @staticmethod
+    def _failed_pages(segment, crawl):
+        """:return: number of failed 'page' units of the crawl of segment"""
+        return sum(
+            json.loads(payload)['crawl'] == crawl
+            for payload, in db.session.query(CrawlUnit.payload).filter_by(
+                kind='page', segmentation=segment, status=FAILED)
+        )
+
+    def process(self, unit):
+        payload = json.loads(unit.payload)
+        segment = unit.segmentation
+        crawler = self.crawler(segment)
+        if unit.kind == 'offers':
+            offers = crawler.offer_list(
+                crawler.available_contract_conditions())
+            if self.queue.finish(unit):
+                db.session.add_all([
+                    _unit('page', segment, {'crawl': payload['crawl'],
+                                            'offer': offer, 'page': 1})
+                    for offer in offers
+                ] + [_unit('finalize', segment, {'crawl': payload['crawl']})])
+        elif unit.kind == 'page':
+            offer, page = payload['offer'], payload['page']
+            devices_json = crawler._device_page(offer, page)
+            if not self.queue.finish(unit):
+                db.session.rollback()
+                return
+            if page == 1:
+                db.session.add_all([
+                    _unit('page', segment, {'crawl': payload['crawl'],
+                                            'offer': offer, 'page': next_page})
+                    for next_page in range(
+                        2, devices_json['pageInfo']['pages'] + 1)
+                ])
+            # every unit of one crawl pings offers with the same time
+            crawler.scrapping_time = datetime.datetime.strptime(
+                payload['crawl'], TIME_FORMAT)
+            crawler.save_or_update_devices(devices_json['devices'], offer,
+                                           commit=False)
+            crawler.save_price_history(offer, commit=False)
+        elif unit.kind == 'finalize':
+            if not self.queue.finish(unit):
+                db.session.rollback()
+                return
+            # offers on pages which failed were not seen either
+            if not self._failed_pages(segment, payload['crawl']):
+                crawler.scrapping_time = datetime.datetime.strptime(
+                    payload['crawl'], TIME_FORMAT)
+                crawler.mark_inactive_offers()
+        elif unit.kind == 'discovery':
+            product_ids = payload['product_ids']
+            discover_new_skus(crawler, batch_size=len(product_ids),
+                              product_ids=product_ids, commit=False)
+            if not self.queue.finish(unit):
+                db.session.rollback()
+                return
+        db.session.commit()
+
+    def run(self, exit_when_idle=False):
+        """
+        Processes units until stopped, or until every unit of the queue
+        is done or failed if `exit_when_idle`
+        """
+        heartbeat = _Heartbeat(self.queue, db.engine)
+        heartbeat.start()
+        try:
+            while True:
+                units = self.queue.lease()
+                if not units:
+                    if exit_when_idle and not self.queue.unfinished():
+                        return
+                    time.sleep(self.poll)
+                    continue
+                heartbeat.unit_ids = frozenset(unit.id for unit in units)
+                for unit in units:
+                    try:
+                        self.process(unit)
+                        self.processed += 1
+                    except Exception:
+                        traceback.print_exc()
+                        # identity map may hold rows of the failed save
+                        self.crawlers.pop(unit.segmentation, None)
+                        self.queue.fail(unit)
+                        self.failed += 1
+                    heartbeat.unit_ids = heartbeat.unit_ids - {unit.id}
+        finally:
+            heartbeat.stopped.set()
@@ -7,10 +7,21 @@ from flask.ext.script import Manager, Shell
 from flask.ext.migrate import Migrate, MigrateCommand
 
 from app import create_app, db, models
-from config import config
+from config import config, Config
 from crawler.web_crawler import WebCrawler
+from crawler.async_crawler import AsyncWebCrawler
+from crawler.cache import ResponseCache
+from crawler.checkpoint import Frontier
+from crawler.replay import Cassette, RecordingTransport
+from crawler.scheduler import CrawlScheduler
+from crawler.workqueue import (CrawlWorker, WorkQueue, enqueue_crawl,
+                               enqueue_discovery)
+from crawler.availability import refresh_availability
+from crawler.discovery import discover_new_skus
+from crawler.parallel import crawl_segments
 
-app = create_app(os.getenv('FLASK_CONFIG') or 'default')
+config_name = os.getenv('FLASK_CONFIG') or 'default'
+app = create_app(config_name)
 
 manager = Manager(app)
 migrate = Migrate(app, db)
@@ -33,32 +44,120 @@ def test():
 
 
 @manager.command
-def dev_crawl():
+def dev_crawl(concurrency=0, no_cache=False, force=False, resume=False):
     """Mini crawl for one process used to populate dev database"""
     start = timer()
-    crawler = WebCrawler("IND.NEW.POSTPAID.MNP")
-    contract_conditions = crawler.available_contract_conditions()
-    offers = crawler.offer_list(contract_conditions=contract_conditions)
-    for offer in offers:
-        pages = crawler.pages(offer)
-        for i in range(pages):
-            devices = crawler.gather_devices(offer, i+1)
-            for device in devices:
-                crawler.save_or_update_device(device, offer)
-    crawler.save_new_found_skus()
-    crawler.save_request_counter()
+    cache = ResponseCache(bypass=no_cache)
+    frontier = Frontier("IND.NEW.POSTPAID.MNP", 'dev_crawl')
+    frontier.start(resume=resume)
+    if concurrency:
+        crawler = AsyncWebCrawler("IND.NEW.POSTPAID.MNP",
+                                  concurrency=int(concurrency), cache=cache,
+                                  incremental=not force, frontier=frontier)
+    else:
+        crawler = WebCrawler("IND.NEW.POSTPAID.MNP", cache=cache,
+                             incremental=not force, frontier=frontier)
+    crawler.crawl()
+    frontier.clear()
+    crawler.save_metrics()
     end = timer()
+    for endpoint, stats in crawler.transport.summary().items():
+        print("%s: %s" % (endpoint, stats))
+    print("Cache: %d hits, %d misses" % (cache.hits, cache.misses))
+    for kind, lookups in crawler.identity.summary().items():
+        print("Identity map %s: %s" % (kind, lookups))
+    print("Unchanged devices: %d" % crawler.unchanged_devices)
+    print("Skus synced: %d, duplicate devices skipped: %d" %
+          (len(crawler.synced_devices), crawler.duplicate_devices))
+    print("Stages: %s" % crawler.stages.to_json())
+    print("Recovered from interrupted run: %f seconds" %
+          frontier.recovered_seconds)
     print("It took %f seconds" % (end-start))
 
 
 @manager.command
-def dev_availability_check():
+def crawl_all(workers=4, no_cache=False, force=False, resume=False):
+    """Crawl of every segment spread across a pool of worker processes"""
+    start = timer()
+    total_requests = 0
+    for segment, seconds, requests, rates, recovered in crawl_segments(
+            Config.SEGMENTS, config_name, int(workers), no_cache,
+            incremental=not force, resume=resume):
+        total_requests += requests
+        print("%s: %f seconds (%f recovered), %d requests, rates %s" % (
+            segment, seconds, recovered, requests, rates))
+    # new skus are searched once for all segments, not per worker
+    crawler = WebCrawler(None, cache=ResponseCache(bypass=no_cache))
+    discovery = discover_new_skus(crawler)
+    crawler.save_metrics()
+    total_requests += crawler.request_counter
+    print("New skus discovery: %s, %d requests" % (discovery,
+                                                    crawler.request_counter))
+    end = timer()
+    print("It took %f seconds, %d requests" % (end - start, total_requests))
+
+
+@manager.command
+def crawl_scheduler(budget=0, poll=0):
+    """Keeps refreshing offers of every segment, volatile ones more often"""
+    scheduler = CrawlScheduler(Config.SEGMENTS, budget=int(budget) or None)
+    scheduler.run_forever(poll=float(poll) or None)
+
+
+@manager.command
+def enqueue(discovery=False):
+    """Queues a crawl of every segment, or new skus discovery, for workers"""
+    if discovery:
+        units = enqueue_discovery()
+    else:
+        units = enqueue_crawl(Config.SEGMENTS)
+    print("Queued %d units, queue: %s" % (units, WorkQueue.counts()))
+
+
+@manager.command
+def crawl_worker(worker_id='', exit_when_idle=False):
+    """Processes crawl units from the shared queue, on any node"""
+    start = timer()
+    worker = CrawlWorker(WorkQueue(worker_id=worker_id or None))
+    try:
+        worker.run(exit_when_idle=exit_when_idle)
+    finally:
+        print("%d units processed, %d failed" % (worker.processed,
+                                                 worker.failed))
+        print("It took %f seconds" % (timer() - start))
+
+
+@manager.command
+def dev_availability_check(concurrency=0, resume=False):
     """Mini crawl for one process used to check availability"""
     start = timer()
     crawler = WebCrawler("IND.NEW.POSTPAID.MNP")
-    crawler.update_availability()
-    crawler.save_request_counter()
+    frontier = Frontier("IND.NEW.POSTPAID.MNP", 'availability')
+    frontier.start(resume=resume)
+    stats = refresh_availability(crawler, workers=int(concurrency) or None,
+                                 frontier=frontier)
+    frontier.clear()
+    crawler.save_metrics()
+    end = timer()
+    print("%d of %d skus changed availability" % (stats['flipped'],
+                                                  stats['skus']))
+    print("Recovered from interrupted run: %f seconds" %
+          frontier.recovered_seconds)
+    print("It took %f seconds" % (end - start))
+
+
+@manager.command
+def record_cassette(path=''):
+    """dev_crawl and availability check recorded for crawler.replay"""
+    start = timer()
+    cassette = Cassette(path or None)
+    crawler = WebCrawler("IND.NEW.POSTPAID.MNP",
+                         transport=RecordingTransport(cassette))
+    crawler.crawl()
+    refresh_availability(crawler)
+    cassette.save()
     end = timer()
+    print("Recorded %d exchanges to %s" % (len(cassette), cassette.path))
     print("It took %f seconds" % (end - start))
 
 if __name__ == "__main__":
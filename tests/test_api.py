@@ -1,8 +1,28 @@
+import datetime
 import json
 import unittest
+from urllib.parse import urlsplit
 from flask import url_for
+from sqlalchemy import event
 from app import create_app, db
-from app.models import Product, Photo, Offer, SKU
+from app.api_v1_0.pagination import encode_cursor
+from app.models import Product, Photo, Offer, PriceChange, SKU
+
+
+class QueryCounter:
+    """Counts SQL statements executed by db.engine within the block"""
+    def __init__(self):
+        self.count = 0
+
+    def _count(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(db.engine, 'before_cursor_execute', self._count)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(db.engine, 'before_cursor_execute', self._count)
 
 
 class ApiTestCase(unittest.TestCase):
@@ -441,4 +461,219 @@ class ApiTestCase(unittest.TestCase):
         self.assertIn('page', json_response['meta'])
         self.assertIn('total_pages', json_response['meta'])
         self.assertIn('previous', json_response['meta'])
-        self.assertIn('next', json_response['meta'])
\ No newline at end of file
+        self.assertIn('next', json_response['meta'])
+
+    def test_offers_can_be_filtered_to_active_ones(self):
+        product = Product(model_name='Lumia 520', manufacturer='Nokia',
+                          product_type='PHONE')
+        sku = SKU(stock_code='nokia-lumia-520-black', base_product=product)
+        offer_1 = Offer(
+            segmentation="IND.NEW.POSTPAID.ACQ",
+            sku=sku, market="IND", offer_code="NSZAS24A",
+            tariff_plan_code="15F2F", contract_condition_code="24A"
+        )
+        offer_2 = Offer(
+            segmentation="IND.NEW.POSTPAID.ACQ",
+            sku=sku, market="IND", offer_code="NSZAS24A",
+            tariff_plan_code="15F3F", contract_condition_code="24A"
+        )
+        offer_2.is_active = False
+        db.session.add_all([product, sku, offer_1, offer_2])
+        db.session.commit()
+
+        response = self.client.get(url_for('api.get_offers'),
+                                   query_string={'active': 1,
+                                                 'with_total': 1})
+        json_response = json.loads(response.data.decode('utf-8'))
+        self.assertEqual([offer['tariff_plan_code']
+                          for offer in json_response['offers']], ['15F2F'])
+        self.assertEqual(json_response['meta']['total_items'], 1)
+        self.assertIn('active=1', json_response['meta']['first'])
+
+        response = self.client.get(url_for('api.get_offers_for_sku',
+                                           stock_code=sku.stock_code),
+                                   query_string={'active': 0})
+        json_response = json.loads(response.data.decode('utf-8'))
+        self.assertEqual([offer['tariff_plan_code']
+                          for offer in json_response['offers']], ['15F3F'])
+
+    def test_price_history_of_offer_and_sku(self):
+        product = Product(model_name='Lumia 520', manufacturer='Nokia',
+                          product_type='PHONE')
+        sku = SKU(stock_code='nokia-lumia-520-black', base_product=product)
+        offer = Offer(
+            segmentation="IND.NEW.POSTPAID.ACQ",
+            sku=sku, market="IND", offer_code="NSZAS24A",
+            tariff_plan_code="15F2F", contract_condition_code="24A"
+        )
+        db.session.add_all([product, sku, offer])
+        db.session.commit()
+        for day, price in [(1, 100.0), (10, 90.0), (20, 80.0)]:
+            db.session.add(PriceChange(
+                offer_id=offer.id, recorded_at=datetime.datetime(2015, 3, day),
+                price=price, abo_price=50.0
+            ))
+        db.session.commit()
+
+        # price in effect since March 5th and its later changes
+        response = self.client.get(
+            url_for('api.get_offer_prices', pk=offer.id),
+            query_string={'since': '2015-03-05', 'until': '2015-03-15'}
+        )
+        self.assertEqual(response.status_code, 200)
+        json_response = json.loads(response.data.decode('utf-8'))
+        self.assertEqual([price['product_price']
+                          for price in json_response['prices']],
+                         [100.0, 90.0])
+
+        response = self.client.get(url_for('api.get_sku_prices',
+                                           stock_code=sku.stock_code))
+        json_response = json.loads(response.data.decode('utf-8'))
+        self.assertEqual([price['recorded_at']
+                          for price in json_response['prices']],
+                         ['2015-03-01T00:00:00', '2015-03-10T00:00:00',
+                          '2015-03-20T00:00:00'])
+
+        response = self.client.get(url_for('api.get_sku_prices',
+                                           stock_code='not-existing'))
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(
+            url_for('api.get_offer_prices', pk=offer.id),
+            query_string={'since': 'March'}
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def add_products(self, count):
+        added = Product.query.count()
+        for i in range(added, added + count):
+            product = Product(manufacturer="Nokia", model_name="Lumia %d" % i,
+                              product_type="PHONE")
+            db.session.add_all([product] + [
+                SKU(base_product=product, stock_code="lumia-%d-%s" % (i, color))
+                for color in ("black", "white")
+            ])
+        db.session.commit()
+
+    def test_products_are_listed_in_constant_number_of_queries(self):
+        queries = []
+        for count in (2, 18):
+            self.add_products(count)
+            with QueryCounter() as counter:
+                response = self.client.get(url_for('api.get_products'),
+                                           query_string={'per_page': 100})
+            queries.append(counter.count)
+        self.assertEqual(queries[0], queries[1])
+        json_response = json.loads(response.data.decode('utf-8'))
+        self.assertEqual(len(json_response['products']), 20)
+        product = json_response['products'][-1]
+        self.assertEqual(product['sku_count'], 2)
+        self.assertIn('lumia-19-black', product['skus'][0])
+
+    def test_skus_are_listed_in_constant_number_of_queries(self):
+        queries = []
+        for count in (2, 18):
+            self.add_products(count)
+            for sku in SKU.query.filter(~SKU.photos.any()):
+                db.session.add(Photo(sku=sku, default=True,
+                                     url="http://photo.com/%s.jpg"
+                                         % sku.stock_code))
+                db.session.add(Offer(
+                    segmentation="IND.NEW.POSTPAID.ACQ",
+                    sku=sku, market="IND", offer_code="NSZAS24A",
+                    tariff_plan_code="15F2F", contract_condition_code="24A"
+                ))
+            db.session.commit()
+            with QueryCounter() as counter:
+                response = self.client.get(url_for('api.get_skus'),
+                                           query_string={'per_page': 100})
+            queries.append(counter.count)
+        self.assertEqual(queries[0], queries[1])
+        json_response = json.loads(response.data.decode('utf-8'))
+        self.assertEqual(len(json_response['skus']), 40)
+        sku = json_response['skus'][-1]
+        self.assertEqual(sku['stock_code'], 'lumia-19-white')
+        self.assertIn('Nokia Lumia 19', sku['product'])
+        self.assertEqual(sku['photos'][0]['url'],
+                         'http://photo.com/lumia-19-white.jpg')
+        self.assertIn('15F2F', sku['offers'][0])
+
+    def follow(self, link):
+        """Gets a link from meta, test client drops query of full urls"""
+        parts = urlsplit(link)
+        response = self.client.get(parts.path, query_string=parts.query)
+        return json.loads(response.data.decode('utf-8'))
+
+    def test_offers_are_paginated_with_cursors(self):
+        product = Product(model_name='Lumia 520', manufacturer='Nokia',
+                          product_type='PHONE')
+        sku = SKU(stock_code='nokia-lumia-520-black', base_product=product)
+        db.session.add_all([product, sku] + [Offer(
+            segmentation="IND.NEW.POSTPAID.ACQ",
+            sku=sku, market="IND", offer_code="NSZAS24A",
+            tariff_plan_code="15F%dF" % i, contract_condition_code="24A"
+        ) for i in range(10)])
+        db.session.commit()
+
+        first_page = self.follow(url_for('api.get_offers', per_page=3))
+        self.assertEqual(first_page['meta']['page'], 1)
+        self.assertIsNone(first_page['meta']['previous'])
+        self.assertIsNone(first_page['meta']['total_items'])
+        ids, pages, page = [], [], first_page
+        while True:
+            ids.extend(offer['id'] for offer in page['offers'])
+            pages.append(page['meta']['page'])
+            if page['meta']['next'] is None:
+                break
+            page = self.follow(page['meta']['next'])
+        self.assertEqual(ids, list(range(1, 11)))
+        self.assertEqual(pages, [1, 2, 3, 4])
+
+        # back from the last page
+        previous = self.follow(page['meta']['previous'])
+        self.assertEqual([offer['id'] for offer in previous['offers']],
+                         [7, 8, 9])
+        self.assertEqual(previous['meta']['page'], 3)
+        last = self.follow(first_page['meta']['last'])
+        self.assertEqual([offer['id'] for offer in last['offers']],
+                         [8, 9, 10])
+
+        with_total = self.follow(url_for('api.get_offers', per_page=3,
+                                         with_total=1))
+        self.assertEqual(with_total['meta']['total_items'], 10)
+        self.assertEqual(with_total['meta']['total_pages'], 4)
+        last = self.follow(with_total['meta']['last'])
+        self.assertEqual([offer['id'] for offer in last['offers']],
+                         [8, 9, 10])
+        self.assertEqual(last['meta']['page'], 4)
+        self.assertIsNone(last['meta']['next'])
+        previous = self.follow(last['meta']['previous'])
+        self.assertEqual([offer['id'] for offer in previous['offers']],
+                         [5, 6, 7])
+        self.assertEqual(previous['meta']['page'], 3)
+
+        capped = self.follow(url_for('api.get_offers', per_page=1000))
+        self.assertEqual(capped['meta']['per_page'],
+                         self.app.config['API_MAX_PER_PAGE'])
+
+    def test_invalid_cursors_are_rejected(self):
+        cursors = ['not-a-cursor', 'e30=', encode_cursor({'page': None}),
+                   encode_cursor({'page': 1000}),
+                   encode_cursor({'after': None, 'page': 2}),
+                   encode_cursor({'after': 1, 'before': 5}),
+                   encode_cursor({'page': '2'}), encode_cursor([1])]
+        for cursor in cursors:
+            response = self.client.get(url_for('api.get_offers'),
+                                       query_string={'cursor': cursor})
+            self.assertEqual(response.status_code, 400, cursor)
+
+    def test_deep_pages_cost_the_same_as_first_page(self):
+        self.add_products(30)
+        queries = []
+        link = url_for('api.get_products', per_page=5)
+        while link:
+            with QueryCounter() as counter:
+                page = self.follow(link)
+            queries.append(counter.count)
+            link = page['meta']['next']
+        self.assertEqual(len(queries), 6)
+        self.assertEqual(set(queries), {queries[0]})
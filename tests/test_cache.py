@@ -0,0 +1,43 @@
+import shutil
+import tempfile
+import unittest
+
+from config import Config
+from crawler.cache import ResponseCache, CachedResponse
+
+
+class ResponseCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_caches_by_endpoint_and_form_data(self):
+        cache = ResponseCache(directory=self.directory)
+        data = {"processSegmentationCode": "IND.NEW.POSTPAID.ACQ"}
+        cache.set(Config.DEVICE_LIST, data, CachedResponse(b'{"a": 1}'))
+        self.assertEqual(cache.get(Config.DEVICE_LIST, data).json(),
+                         {"a": 1})
+        self.assertIsNone(cache.get(Config.DEVICE_LIST, {"other": "data"}))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_skips_expired_uncacheable_and_bypassed_entries(self):
+        cache = ResponseCache(directory=self.directory,
+                              ttl={'DEVICE_LIST': -1})
+        cache.set(Config.DEVICE_LIST, {}, CachedResponse(b'{}'))
+        self.assertIsNone(cache.get(Config.DEVICE_LIST, {}))
+        cache = ResponseCache(directory=self.directory)
+        cache.set(Config.DEVICE_AVAILABLE, {}, CachedResponse(b'{}'))
+        self.assertIsNone(cache.get(Config.DEVICE_AVAILABLE, {}))
+        cache.set(Config.DEVICE_LIST, {}, CachedResponse(b'{}'))
+        cache.bypass = True
+        self.assertIsNone(cache.get(Config.DEVICE_LIST, {}))
+
+    def test_evicts_oldest_entries_over_size_limit(self):
+        cache = ResponseCache(directory=self.directory, max_bytes=300)
+        for i in range(10):
+            cache.set(Config.DEVICE_LIST, {"page": i},
+                      CachedResponse(b'x' * 50))
+        self.assertIsNone(cache.get(Config.DEVICE_LIST, {"page": 0}))
+        self.assertIsNotNone(cache.get(Config.DEVICE_LIST, {"page": 9}))
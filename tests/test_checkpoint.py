@@ -0,0 +1,61 @@
+import shutil
+import tempfile
+import unittest
+
+from crawler.checkpoint import Frontier
+from crawler.web_crawler import WebCrawler
+from tests.test_crawler import StubTransport
+
+OFFER = {
+    "offerNSICode": "NSZAS24A",
+    "tariffPlanCode": "5F20A",
+    "contractConditionCode": "24A"
+}
+
+
+class FrontierTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_resume_loads_progress_of_interrupted_run(self):
+        frontier = Frontier("IND.NEW.POSTPAID.ACQ", 'devices', self.directory)
+        frontier.start()
+        frontier.set_pages(OFFER, 3)
+        frontier.mark_page_done(OFFER, 1)
+        frontier.mark_probed(['lg-g2-mini-lte-black'])
+        with open(frontier.path, 'a') as f:
+            f.write('{"offer": ["24A"')
+
+        resumed = Frontier("IND.NEW.POSTPAID.ACQ", 'devices', self.directory)
+        resumed.start(resume=True)
+        self.assertEqual(resumed.pages(OFFER), 3)
+        self.assertTrue(resumed.is_page_done(OFFER, 1))
+        self.assertFalse(resumed.is_page_done(OFFER, 2))
+        self.assertTrue(resumed.is_probed('lg-g2-mini-lte-black'))
+        self.assertGreaterEqual(resumed.recovered_seconds, 0)
+        # offers saved by both runs get the same scrapping date
+        self.assertEqual(resumed.scrapping_time, frontier.scrapping_time)
+        self.assertEqual(WebCrawler("IND.NEW.POSTPAID.ACQ",
+                                    frontier=resumed).scrapping_time,
+                         frontier.scrapping_time)
+
+        restarted = Frontier("IND.NEW.POSTPAID.ACQ", 'devices',
+                             self.directory)
+        restarted.start()
+        self.assertIsNone(restarted.pages(OFFER))
+
+    def test_resumed_crawl_fetches_only_remaining_pages(self):
+        frontier = Frontier("IND.NEW.POSTPAID.ACQ", 'devices', self.directory)
+        frontier.start()
+        frontier.set_pages(OFFER, 3)
+        frontier.mark_page_done(OFFER, 1)
+        frontier.mark_page_done(OFFER, 3)
+        transport = StubTransport()
+        crawler = WebCrawler(segment="IND.NEW.POSTPAID.ACQ",
+                             transport=transport, frontier=frontier)
+        pages = list(crawler.iter_device_pages(OFFER))
+        self.assertEqual([page for page, _ in pages], [2])
+        self.assertEqual([data["page"] for data in transport.requests], [2])
@@ -1,17 +1,153 @@
+import functools
+import json
+import os
+import shutil
+import tempfile
 import unittest
-from config import config
+from config import config, Config
 from crawler.web_crawler import WebCrawler
+from crawler.async_crawler import AsyncWebCrawler
+from crawler.replay import Cassette, RecordingTransport, ReplayServer
+from crawler.availability import refresh_availability
+from crawler.checkpoint import Frontier
+from crawler.discovery import discover_new_skus
+from crawler.streaming import CHUNK_SIZE
 
 from app import db, create_app
-from app.models import Product, Photo, SKU, Offer
+from app.models import Product, Photo, PriceChange, SKU, Offer
+
+
+# live tests are recorded here when CRAWLER_RECORD is set, and replayed
+# offline from here once recorded
+CASSETTE = os.path.join(os.path.dirname(__file__), 'cassettes',
+                        'crawler.json')
+
+
+def upstream(test):
+    """
+    Marks a test talking to upstream; without a recorded cassette it only
+    runs while recording one
+    """
+    @functools.wraps(test)
+    def wrapper(self):
+        if not (self.replay or self.recording):
+            self.skipTest("no cassette at %s, record it with "
+                          "CRAWLER_RECORD=1" % CASSETTE)
+        return test(self)
+    return wrapper
+
+
+class StubResponse:
+    def __init__(self, json_data=None, content=b''):
+        self.json_data = json_data
+        self.content = content or json.dumps(json_data).encode('utf-8')
+        self.status_code = 200
+
+    def json(self):
+        return self.json_data
+
+    def iter_content(self, chunk_size=1):
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+
+
+def stub_device(sku):
+    """Device as DEVICE_LIST lists it, with fields crawler never reads"""
+    return {
+        "brand": "LG", "modelName": "G2 Mini", "productType": "PHONE",
+        "sku": sku, "available": "AVAILABLE", "devicePriority": 10,
+        "deviceName": "LG G2 Mini LTE",
+        "prices": {"grossPrice": "99,00", "netPrice": "80,49"},
+        "imagesOnDetails": [{"normalImage": "http://photo.com/1.jpg",
+                             "zoomImage": "http://photo.com/1-zoom.jpg",
+                             "defaultImage": True}]
+    }
+
+
+STUB_OFFERS = [
+    {"offerNSICode": "NSZAS24A", "tariffPlanCode": tariff_plan_code,
+     "contractConditionCode": "24A", "monthlyFeeGross": "50,00"}
+    for tariff_plan_code in ("5F20A", "5F30A")
+]
+
+
+class StubTransport:
+    """
+    Serves one contract condition with STUB_OFFERS, and 3 pages of one
+    device for every offer
+    """
+    def __init__(self):
+        self.requests = []
+
+    def post(self, url, data, decode=None):
+        self.requests.append(data)
+        if "page" in data:
+            r = StubResponse({
+                "pageInfo": {"pages": 3},
+                "devices": [stub_device("sku-%s" % data["page"])]
+            })
+        elif "contractConditionCode" in data:
+            r = StubResponse({"rotator": STUB_OFFERS})
+        else:
+            r = StubResponse({"pageInfo": {"availableContractConditions": [
+                {"value": "24 miesiace"}
+            ]}})
+        return decode(r.iter_content(CHUNK_SIZE)) if decode else r
+
+
+class ProductPageStubTransport:
+    """Product pages with black and white LG G2 Mini, always available"""
+    PRODUCT_PAGE = b"""
+        <input name="color" device-skus="lg-g2-mini-lte-black"/>
+        <input name="color" device-skus="lg-g2-mini-lte-white"/>
+        <div id="phone-carousel"><img src="http://photo.com/1.jpg"/></div>
+    """
+
+    def __init__(self):
+        self.requests = 0
+
+    def get(self, url):
+        self.requests += 1
+        return StubResponse(content=self.PRODUCT_PAGE)
+
+    def post(self, url, data):
+        self.requests += 1
+        if url == Config.DEVICE_AVAILABLE:
+            return StubResponse({"deviceAvailables": [
+                {"available": "AVAILABLE"}
+            ]})
+        return StubResponse({"devicesPrices": [{"grossPrice": "1,00"}]})
 
 
 class CrawlerTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.recording = bool(os.environ.get('CRAWLER_RECORD'))
+        cls.cassette = Cassette(CASSETTE)
+        cls.replay = None
+        if not cls.recording and len(cls.cassette):
+            cls.replay = ReplayServer(cls.cassette).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        if cls.recording:
+            cls.cassette.save()
+        if cls.replay:
+            cls.replay.stop()
+
+    def transport(self, **kwargs):
+        if self.replay:
+            return self.replay.transport(**kwargs)
+        if self.recording:
+            return RecordingTransport(self.cassette, **kwargs)
+        return None
+
     def setUp(self):
         self.app = create_app('testing')
         self.app_context = self.app.app_context()
         self.app_context.push()
-        self.crawler = WebCrawler(segment="IND.NEW.POSTPAID.ACQ")
+        self.crawler = WebCrawler(segment="IND.NEW.POSTPAID.ACQ",
+                                  transport=self.transport())
         db.create_all()
 
     def tearDown(self):
@@ -19,6 +155,7 @@ class CrawlerTestCase(unittest.TestCase):
         db.drop_all()
         self.app_context.pop()
 
+    @upstream
     def test_offers_list_gatherer(self):
         contract_conditions = self.crawler.available_contract_conditions()
         offer_list = self.crawler.offer_list(
@@ -31,6 +168,19 @@ class CrawlerTestCase(unittest.TestCase):
         self.assertIn("contractConditionCode", one_offer)
         self.assertIn("monthlyFeeGross", one_offer)
 
+    @upstream
+    def test_async_offers_list_gatherer(self):
+        crawler = AsyncWebCrawler(segment="IND.NEW.POSTPAID.ACQ",
+                                  concurrency=4,
+                                  transport=self.transport(pool_size=4))
+        offer_list = crawler.run(crawler.fetch_offers())
+        contract_conditions = self.crawler.available_contract_conditions()
+        self.assertEqual(crawler.request_counter,
+                         len(contract_conditions) + 1)
+        self.assertIn("offerNSICode", offer_list[0])
+        self.assertIn("monthlyFeeGross", offer_list[0])
+
+    @upstream
     def test_pages_info(self):
         offer = {
             "offerNSICode": "NSZAS24A",
@@ -40,6 +190,80 @@ class CrawlerTestCase(unittest.TestCase):
         page_count = self.crawler.pages(offer=offer)
         self.assertIsInstance(page_count, int)
 
+    def test_device_pages_take_page_count_from_first_page(self):
+        transport = StubTransport()
+        crawler = WebCrawler(segment="IND.NEW.POSTPAID.ACQ",
+                             transport=transport)
+        offer = {
+            "offerNSICode": "NSZAS24A",
+            "tariffPlanCode": "5F20A",
+            "contractConditionCode": "24A"
+        }
+        pages = list(crawler.iter_device_pages(offer))
+        self.assertEqual([page for page, _ in pages], [1, 2, 3])
+        self.assertEqual([device["sku"] for device in pages[2][1]],
+                         ["sku-3"])
+        self.assertNotIn("deviceName", pages[2][1][0])
+        self.assertEqual([data["page"] for data in transport.requests],
+                         [1, 2, 3])
+        self.assertEqual(crawler.request_counter, 3)
+
+    def stub_crawl(self, crawler_class, **kwargs):
+        """
+        Crawls StubTransport's segment from an empty database
+        :return: (saved offers, requests sent, request counter)
+        """
+        transport = StubTransport()
+        crawler = crawler_class(segment="IND.NEW.POSTPAID.ACQ",
+                                transport=transport, **kwargs)
+        crawler.crawl_devices()
+        offers = sorted((offer.tariff_plan_code, offer.sku.stock_code,
+                         offer.price, offer.is_active)
+                        for offer in Offer.query)
+        requests = sorted(tuple(sorted(data.items()))
+                          for data in transport.requests)
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+        return offers, requests, crawler.request_counter
+
+    def test_async_crawl_saves_what_sync_crawl_saves(self):
+        saved = self.stub_crawl(WebCrawler)
+        self.assertEqual(self.stub_crawl(AsyncWebCrawler, concurrency=3),
+                         saved)
+        offers, requests, request_counter = saved
+        self.assertEqual(len(offers), 6)
+        # contract conditions, offer list and 3 pages of both offers
+        self.assertEqual(len(requests), 8)
+        self.assertEqual(request_counter, 8)
+
+    def test_async_crawl_skips_pages_done_in_frontier(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        def frontier(job):
+            first, second = STUB_OFFERS
+            frontier = Frontier("IND.NEW.POSTPAID.ACQ", job, directory)
+            frontier.start()
+            frontier.set_pages(first, 3)
+            frontier.mark_page_done(first, 1)
+            frontier.mark_page_done(first, 2)
+            frontier.set_pages(second, 3)
+            frontier.mark_page_done(second, 1)
+            return frontier
+
+        saved = self.stub_crawl(WebCrawler, frontier=frontier('sync'))
+        self.assertEqual(self.stub_crawl(AsyncWebCrawler, concurrency=3,
+                                         frontier=frontier('async')),
+                         saved)
+        offers, requests, request_counter = saved
+        self.assertEqual([offer[:2] for offer in offers],
+                         [("5F20A", "sku-3"), ("5F30A", "sku-2"),
+                          ("5F30A", "sku-3")])
+        self.assertEqual(request_counter, 5)
+        self.assertEqual(len(requests), 5)
+
+    @upstream
     def test_device_gatherer(self):
         offer = {
             "offerNSICode": "NSZAS24A",
@@ -56,6 +280,7 @@ class CrawlerTestCase(unittest.TestCase):
         self.assertIn("modelName", device)
         self.assertIn("sku", device)
 
+    @upstream
     def test_saving_devices(self):
         contract_conditions = self.crawler.available_contract_conditions()
         offer_list = self.crawler.offer_list(
@@ -74,6 +299,7 @@ class CrawlerTestCase(unittest.TestCase):
         )
         self.assertEqual(Photo.query.filter_by(default=True).count(), 1)
 
+    @upstream
     def test_is_updating_existing_rows(self):
         contract_conditions = self.crawler.available_contract_conditions()
         offer_list = self.crawler.offer_list(
@@ -101,6 +327,212 @@ class CrawlerTestCase(unittest.TestCase):
         self.assertIsNotNone(o.old_price)
         self.assertEqual(Photo.query.filter_by(default=True).count(), 1)
 
+    def test_saving_page_of_devices(self):
+        offer = {
+            "offerNSICode": "NSZAS24A",
+            "tariffPlanCode": "5F20A",
+            "contractConditionCode": "24A",
+            "monthlyFeeGross": "100,00"
+        }
+        devices = [
+            {
+                "brand": "LG", "modelName": "G2 Mini",
+                "productType": "PHONE", "sku": "lg-g2-mini-lte-" + color,
+                "available": "AVAILABLE", "devicePriority": 10,
+                "prices": {"grossPrice": "99,00"},
+                "imagesOnDetails": [
+                    {"normalImage": "http://photo.com/%s-1.jpg" % color,
+                     "defaultImage": True},
+                    {"normalImage": "http://photo.com/%s-2.jpg" % color,
+                     "defaultImage": False}
+                ]
+            } for color in ("black", "white")
+        ]
+        self.crawler.save_or_update_devices(devices, offer)
+        self.assertEqual(Product.query.count(), 1)
+        self.assertEqual(SKU.query.count(), 2)
+        self.assertEqual(Photo.query.count(), 4)
+        self.assertEqual(Offer.query.count(), 2)
+
+        devices[0]["prices"]["grossPrice"] = "1,00"
+        self.crawler.save_or_update_devices(devices, offer)
+        self.assertEqual(Offer.query.count(), 2)
+        self.assertEqual(Photo.query.count(), 4)
+        black = SKU.query.filter_by(stock_code="lg-g2-mini-lte-black").first()
+        offer = Offer.query.filter_by(sku=black).first()
+        self.assertEqual(offer.price, 1.00)
+        self.assertEqual(offer.old_price, 99.00)
+
+    def test_repeated_devices_are_identity_map_hits(self):
+        offer = {
+            "offerNSICode": "NSZAS24A",
+            "tariffPlanCode": "5F20A",
+            "contractConditionCode": "24A",
+            "monthlyFeeGross": "100,00"
+        }
+        device = {
+            "brand": "LG", "modelName": "G2 Mini", "productType": "PHONE",
+            "sku": "lg-g2-mini-lte-black", "available": "AVAILABLE",
+            "devicePriority": 10, "prices": {"grossPrice": "99,00"},
+            "imagesOnDetails": [{"normalImage": "http://photo.com/1.jpg",
+                                 "defaultImage": True}]
+        }
+        self.crawler.save_or_update_device(device, offer)
+        self.assertEqual(self.crawler.identity.misses['skus'], 1)
+        other_offer = dict(offer, tariffPlanCode="5F30A")
+        self.crawler.save_or_update_device(device, other_offer)
+        summary = self.crawler.identity.summary()
+        self.assertEqual(summary['products'], {'hits': 1, 'misses': 1})
+        self.assertEqual(summary['skus'], {'hits': 1, 'misses': 1})
+        self.assertEqual(summary['photos'], {'hits': 1, 'misses': 1})
+        self.assertEqual(summary['offers'], {'hits': 0, 'misses': 2})
+        self.assertEqual(Product.query.count(), 1)
+        self.assertEqual(Offer.query.count(), 2)
+
+    def test_incremental_crawl_skips_unchanged_devices(self):
+        offer = {
+            "offerNSICode": "NSZAS24A",
+            "tariffPlanCode": "5F20A",
+            "contractConditionCode": "24A",
+            "monthlyFeeGross": "100,00"
+        }
+        device = {
+            "brand": "LG", "modelName": "G2 Mini", "productType": "PHONE",
+            "sku": "lg-g2-mini-lte-black", "available": "AVAILABLE",
+            "devicePriority": 10, "prices": {"grossPrice": "99,00"},
+            "imagesOnDetails": [{"normalImage": "http://photo.com/1.jpg",
+                                 "defaultImage": True}]
+        }
+        self.crawler.save_or_update_device(device, offer)
+        crawler = WebCrawler(segment="IND.NEW.POSTPAID.ACQ", incremental=True)
+        crawler.save_or_update_device(device, offer)
+        self.assertEqual(crawler.unchanged_devices, 1)
+        self.assertEqual(Offer.query.first().scrapping_date,
+                         crawler.scrapping_time)
+
+        device["prices"]["grossPrice"] = "1,00"
+        crawler.save_or_update_device(device, offer)
+        self.assertEqual(crawler.unchanged_devices, 1)
+        self.assertEqual(Offer.query.first().price, 1.00)
+
+    def test_offers_not_crawled_again_are_deactivated(self):
+        offer = {
+            "offerNSICode": "NSZAS24A",
+            "tariffPlanCode": "5F20A",
+            "contractConditionCode": "24A",
+            "monthlyFeeGross": "100,00"
+        }
+        devices = [{
+            "brand": "LG", "modelName": "G2 Mini", "productType": "PHONE",
+            "sku": sku, "available": "AVAILABLE", "devicePriority": 10,
+            "prices": {"grossPrice": "99,00"}, "imagesOnDetails": []
+        } for sku in ("lg-g2-mini-lte-black", "lg-g2-mini-lte-white")]
+        self.crawler.save_or_update_devices(devices, offer)
+        self.assertEqual(self.crawler.mark_inactive_offers(), 0)
+
+        crawler = WebCrawler(segment="IND.NEW.POSTPAID.ACQ", incremental=True)
+        crawler.save_or_update_devices(devices[:1], offer)
+        self.assertEqual(crawler.mark_inactive_offers(), 1)
+        self.assertEqual(
+            [(offer.sku.stock_code, offer.is_active)
+             for offer in Offer.query.order_by(Offer.id)],
+            [("lg-g2-mini-lte-black", True), ("lg-g2-mini-lte-white", False)]
+        )
+
+        # offered again
+        crawler = WebCrawler(segment="IND.NEW.POSTPAID.ACQ", incremental=True)
+        crawler.save_or_update_devices(devices, offer)
+        self.assertEqual(crawler.mark_inactive_offers(), 0)
+        self.assertEqual(Offer.query.filter_by(is_active=True).count(), 2)
+
+    def test_offers_never_crawled_are_deactivated(self):
+        offer = {
+            "offerNSICode": "NSZAS24A",
+            "tariffPlanCode": "5F20A",
+            "contractConditionCode": "24A",
+            "monthlyFeeGross": "100,00"
+        }
+        self.crawler.save_or_update_device(
+            stub_device("lg-g2-mini-lte-black"), offer)
+        # a sku found by discovery, but no longer offered by the next crawl
+        saved = Offer.query.one()
+        white = SKU(stock_code="lg-g2-mini-lte-white",
+                    base_product=saved.sku.base_product)
+        db.session.add(WebCrawler._copy_offer(saved, white))
+        db.session.commit()
+        discovered = Offer.query.filter_by(sku=white).one()
+        self.assertIsNone(discovered.scrapping_date)
+
+        crawler = WebCrawler(segment="IND.NEW.POSTPAID.ACQ", incremental=True)
+        crawler.save_or_update_device(stub_device("lg-g2-mini-lte-black"),
+                                      offer)
+        self.assertEqual(crawler.mark_inactive_offers(), 1)
+        db.session.refresh(discovered)
+        self.assertFalse(discovered.is_active)
+
+    def test_device_is_synced_once_across_offers(self):
+        device = stub_device("lg-g2-mini-lte-black")
+        for tariff in ("5F20A", "5F30A", "5F40A"):
+            self.crawler.save_or_update_device(device, {
+                "offerNSICode": "NSZAS24A",
+                "tariffPlanCode": tariff,
+                "contractConditionCode": "24A",
+                "monthlyFeeGross": "100,00"
+            })
+        self.assertEqual(self.crawler.duplicate_devices, 2)
+        self.assertEqual(Offer.query.count(), 3)
+        self.assertEqual(Photo.query.count(), 1)
+
+        # device-level data changed in the meantime
+        device["available"] = "NOT_AVAILABLE"
+        self.crawler.save_or_update_device(device, {
+            "offerNSICode": "NSZAS24A",
+            "tariffPlanCode": "5F50A",
+            "contractConditionCode": "24A",
+            "monthlyFeeGross": "100,00"
+        })
+        self.assertEqual(self.crawler.duplicate_devices, 2)
+        self.assertEqual(SKU.query.one().availability, "NOT_AVAILABLE")
+
+    def test_price_history_records_only_changes(self):
+        offer = {
+            "offerNSICode": "NSZAS24A",
+            "tariffPlanCode": "5F20A",
+            "contractConditionCode": "24A",
+            "monthlyFeeGross": "100,00"
+        }
+        device = stub_device("lg-g2-mini-lte-black")
+        recorded = []
+        for price, abo_price in [("99,00", "100,00"), ("99,00", "100,00"),
+                                 ("1,00", "100,00"), ("1,00", "90,00")]:
+            device["prices"]["grossPrice"] = price
+            offer["monthlyFeeGross"] = abo_price
+            crawler = WebCrawler(segment="IND.NEW.POSTPAID.ACQ",
+                                 incremental=True)
+            crawler.save_or_update_device(device, offer)
+            recorded.append(crawler.save_price_history())
+        self.assertEqual(recorded, [1, 0, 1, 1])
+        self.assertEqual(
+            [(change.price, change.abo_price) for change
+             in PriceChange.query.order_by(PriceChange.recorded_at)],
+            [(99.0, 100.0), (1.0, 100.0), (1.0, 90.0)]
+        )
+
+    def test_price_history_can_be_recorded_for_one_offer(self):
+        offers = [{
+            "offerNSICode": "NSZAS24A",
+            "tariffPlanCode": tariff,
+            "contractConditionCode": "24A",
+            "monthlyFeeGross": "100,00"
+        } for tariff in ("5F20A", "5F30A")]
+        for offer in offers:
+            self.crawler.save_or_update_device(
+                stub_device("lg-g2-mini-lte-black"), offer)
+        self.assertEqual(self.crawler.save_price_history(offers[0]), 1)
+        self.assertEqual(self.crawler.save_price_history(offers[0]), 0)
+        self.assertEqual(self.crawler.save_price_history(), 1)
+
+    @upstream
     def test_another_sku(self):
         product = Product(manufacturer="LG", model_name="G2 Mini",
                           product_type="PHONE")
@@ -114,6 +546,7 @@ class CrawlerTestCase(unittest.TestCase):
         self.assertTrue(len(all_skus_codes) > 1)
         self.assertIn('lg-g2-mini-lte-white', all_skus_codes)
 
+    @upstream
     def test_save_unsaved_sku(self):
         product = Product(manufacturer="LG", model_name="G2 Mini",
                           product_type="PHONE")
@@ -136,6 +569,7 @@ class CrawlerTestCase(unittest.TestCase):
                 stock_code="lg-g2-mini-lte-white").first().availability
         )
 
+    @upstream
     def test_not_inserting_existing_sku(self):
         product = Product(manufacturer="LG", model_name="G2 Mini",
                           product_type="PHONE")
@@ -152,6 +586,7 @@ class CrawlerTestCase(unittest.TestCase):
             SKU.query.filter_by(stock_code="lg-g2-mini-lte-black").count(), 1
         )
 
+    @upstream
     def test_new_found_sku_has_the_same_offer_codes_as_saved_sku(self):
         product = Product(manufacturer="LG", model_name="G2 Mini",
                           product_type="PHONE")
@@ -168,6 +603,7 @@ class CrawlerTestCase(unittest.TestCase):
         for i in range(Offer.query.count()):
             self.assertEqual(Offer.query.get(i+1).offer_code, "NSZAS24A")
 
+    @upstream
     def test_new_found_sku_has_photos(self):
         product = Product(manufacturer="LG", model_name="G2 Mini",
                           product_type="PHONE")
@@ -183,6 +619,7 @@ class CrawlerTestCase(unittest.TestCase):
         new_sku = SKU.query.filter_by(stock_code="lg-g2-mini-lte-white").first()
         self.assertTrue(new_sku.photos.count() >= 1)
 
+    @upstream
     def test_new_found_sku_has_abo_price_and_device_price(self):
         product = Product(manufacturer="LG", model_name="G2 Mini",
                           product_type="PHONE")
@@ -202,6 +639,60 @@ class CrawlerTestCase(unittest.TestCase):
         self.assertEqual(new_offer.abo_price, 100.00)
         self.assertEqual(new_offer.price, 90.00)
 
+    def test_concurrent_discovery_of_new_skus(self):
+        product = Product(manufacturer="LG", model_name="G2 Mini",
+                          product_type="PHONE")
+        sku = SKU(base_product=product, stock_code="lg-g2-mini-lte-black")
+        offer = Offer(
+            segmentation="IND.NEW.POSTPAID.ACQ",
+            sku=sku, market="IND", offer_code="NSZAS24A",
+            tariff_plan_code="5F20A", contract_condition_code="24A"
+        )
+        offer.abo_price = 100.00
+        offer.price = 90.00
+        db.session.add_all([product, sku, offer])
+        db.session.commit()
+        transport = ProductPageStubTransport()
+        crawler = WebCrawler(segment="IND.NEW.POSTPAID.ACQ",
+                             transport=transport)
+        stats = discover_new_skus(crawler, workers=2)
+        self.assertEqual(stats['new_skus'], 1)
+        new_sku = SKU.query.filter_by(stock_code="lg-g2-mini-lte-white").first()
+        self.assertEqual(new_sku.availability, "AVAILABLE")
+        self.assertEqual(new_sku.photos.count(), 1)
+        new_offer = Offer.query.filter_by(sku=new_sku).first()
+        self.assertEqual(new_offer.offer_code, "NSZAS24A")
+        self.assertEqual(new_offer.price, 90.00)
+        self.assertEqual(
+            [(change.offer_id, change.price, change.abo_price)
+             for change in PriceChange.query],
+            [(new_offer.id, 90.00, 100.00)]
+        )
+
+        # colour list did not change, so the product is skipped
+        transport.requests = 0
+        stats = discover_new_skus(crawler, workers=2)
+        self.assertEqual(stats['unchanged_products'], 1)
+        self.assertEqual(transport.requests, 1)
+
+    def test_availability_refresh_writes_only_flipped_skus(self):
+        product = Product(manufacturer="LG", model_name="G2 Mini",
+                          product_type="PHONE")
+        db.session.add(product)
+        for i, availability in enumerate(("AVAILABLE", "NOT_AVAILABLE",
+                                          "AVAILABLE", "RUNNING_OUT")):
+            db.session.add(SKU(base_product=product, stock_code="sku-%d" % i,
+                               availability=availability))
+        db.session.commit()
+        crawler = WebCrawler(segment="IND.NEW.POSTPAID.ACQ",
+                             transport=ProductPageStubTransport())
+        stats = refresh_availability(crawler, workers=2, chunk_size=3)
+        self.assertEqual(stats, {'skus': 4, 'flipped': 2})
+        db.session.expire_all()
+        self.assertEqual({sku.availability for sku in SKU.query},
+                         {"AVAILABLE"})
+
+    @upstream
     def test_sku_availability_is_string_representation(self):
         product = Product(manufacturer="LG", model_name="G2 Mini",
                           product_type="PHONE")
@@ -0,0 +1,29 @@
+import unittest
+
+from crawler.extraction import extract_photo_urls, extract_skus
+
+PRODUCT_PAGE = b"""
+<html><body>
+<form>
+  <input type="radio" name="color" device-skus="lg-g2-mini-lte-black"/>
+  <input type="radio" name="color" device-skus="lg-g2-mini-lte-white"/>
+  <input type="hidden" name="tariff" device-skus="not-a-color"/>
+</form>
+<div id="phone-carousel">
+  <div class="item"><img src="http://photo.com/main.jpg"/></div>
+  <div class="item"><img src="http://photo.com/back.jpg"/></div>
+</div>
+<div id="footer"><img src="http://photo.com/logo.png"/></div>
+</body></html>
+"""
+
+
+class ExtractionTestCase(unittest.TestCase):
+    def test_extract_skus(self):
+        self.assertEqual(extract_skus(PRODUCT_PAGE),
+                         ['lg-g2-mini-lte-black', 'lg-g2-mini-lte-white'])
+
+    def test_extract_photo_urls_only_from_carousel(self):
+        self.assertEqual(extract_photo_urls(PRODUCT_PAGE),
+                         ['http://photo.com/main.jpg',
+                          'http://photo.com/back.jpg'])
@@ -0,0 +1,52 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from crawler.metrics import LatencyHistogram, write_metrics
+from crawler.transport import Transport
+from crawler.web_crawler import WebCrawler
+from tests.test_crawler import StubResponse
+
+
+class LatencyHistogramTestCase(unittest.TestCase):
+    def test_percentiles(self):
+        histogram = LatencyHistogram()
+        self.assertIsNone(histogram.percentile(50))
+        for _ in range(98):
+            histogram.add(0.1)
+        histogram.add(2.0)
+        histogram.add(30.0)
+        self.assertAlmostEqual(histogram.percentile(50), 0.1, delta=0.02)
+        self.assertAlmostEqual(histogram.percentile(99), 2.0, delta=0.4)
+        self.assertEqual(histogram.percentile(100), 30.0)
+        self.assertEqual(histogram.to_json()['max'], 30.0)
+
+
+class WriteMetricsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_appends_one_json_line_per_crawl(self):
+        crawler = WebCrawler(segment="IND.NEW.POSTPAID.ACQ",
+                             transport=Transport())
+        crawler.transport._record('DEVICE_LIST', 0.2, size=1024)
+        crawler._json(StubResponse({"devices": []}))
+        path = os.path.join(self.directory, 'logs', 'metrics.jsonl')
+        write_metrics(crawler, path)
+        write_metrics(crawler, path)
+        with open(path) as metrics:
+            records = [json.loads(line) for line in metrics]
+        self.assertEqual(len(records), 2)
+        record = records[0]
+        self.assertEqual(record['segment'], "IND.NEW.POSTPAID.ACQ")
+        device_list = record['endpoints']['DEVICE_LIST']
+        self.assertEqual(device_list['bytes'], 1024)
+        self.assertEqual(device_list['requests'], 1)
+        self.assertIsNotNone(device_list['latency']['p95'])
+        self.assertEqual(set(record['stages']), {'fetch', 'parse', 'db'})
+        self.assertGreater(record['stages']['parse'], 0)
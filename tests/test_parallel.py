@@ -0,0 +1,118 @@
+import shutil
+import tempfile
+import unittest
+
+from config import Config
+from app import create_app, db
+from app.models import Offer, PriceChange, Product, SKU
+from crawler import parallel
+from crawler.parallel import SegmentCrawler, crawl_segments
+from crawler.streaming import CHUNK_SIZE
+from crawler.transport import Transport
+from tests.test_crawler import StubResponse, stub_device
+
+SEGMENTS = ["IND.NEW.POSTPAID.ACQ", "IND.NEW.POSTPAID.MNP",
+            "SOHO.NEW.POSTPAID.ACQ"]
+
+
+class SegmentStubTransport(Transport):
+    """
+    One offer of 2 pages in every segment, with the same devices in all
+    segments, so workers race for the same products and skus
+    """
+    def post(self, url, data, decode=None):
+        if "page" in data:
+            page = data["page"]
+            r = StubResponse({
+                "pageInfo": {"pages": 2},
+                "devices": [stub_device("sku-%d-%d" % (page, i))
+                            for i in range(3)]
+            })
+        elif "contractConditionCode" in data:
+            r = StubResponse({"rotator": [{
+                "offerNSICode": "NSZAS24A", "tariffPlanCode": "5K0",
+                "contractConditionCode": "24A", "monthlyFeeGross": "50,00"
+            }]})
+        else:
+            r = StubResponse({"pageInfo": {"availableContractConditions": [
+                {"value": "24 miesiace"}
+            ]}})
+        return decode(r.iter_content(CHUNK_SIZE)) if decode else r
+
+
+class RecordingLock:
+    def __init__(self):
+        self.held = False
+        self.acquired = 0
+
+    def __enter__(self):
+        self.held = True
+        self.acquired += 1
+
+    def __exit__(self, *exc_info):
+        self.held = False
+
+
+class ParallelCrawlTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.directory = tempfile.mkdtemp()
+        self.config = (Config.CRAWLER_CACHE_DIR, Config.CRAWLER_FRONTIER_DIR,
+                       Config.CRAWLER_METRICS_FILE)
+        # pool workers are forked, so they see these too
+        Config.CRAWLER_CACHE_DIR = self.directory
+        Config.CRAWLER_FRONTIER_DIR = self.directory
+        Config.CRAWLER_METRICS_FILE = self.directory + '/metrics.jsonl'
+
+    def tearDown(self):
+        (Config.CRAWLER_CACHE_DIR, Config.CRAWLER_FRONTIER_DIR,
+         Config.CRAWLER_METRICS_FILE) = self.config
+        shutil.rmtree(self.directory)
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_workers_share_products_and_skus(self):
+        product = Product(manufacturer="LG", model_name="G2 Mini",
+                          product_type="PHONE")
+        sku = SKU(base_product=product, stock_code="sku-old",
+                  availability="AVAILABLE")
+        stale = Offer(segmentation=SEGMENTS[0], market="IND", sku=sku,
+                      offer_code="NSZAS24A", tariff_plan_code="5K0",
+                      contract_condition_code="24A")
+        db.session.add(stale)
+        db.session.commit()
+
+        summaries = list(crawl_segments(SEGMENTS, 'testing', 3,
+                                        transport=SegmentStubTransport))
+
+        self.assertEqual(sorted(summary[0] for summary in summaries),
+                         sorted(SEGMENTS))
+        # contract conditions, offer list and 2 pages in every segment
+        self.assertEqual([summary[2] for summary in summaries], [4, 4, 4])
+        db.session.expire_all()
+        self.assertEqual(Product.query.count(), 1)
+        self.assertEqual(SKU.query.count(), 7)
+        self.assertEqual(Offer.query.filter_by(is_active=True).count(), 18)
+        self.assertFalse(db.session.merge(stale).is_active)
+        self.assertEqual(PriceChange.query.count(), 18)
+
+    def test_every_write_holds_pool_lock(self):
+        lock = RecordingLock()
+        writes = []
+        parallel._write_lock = lock
+        crawler = SegmentCrawler(SEGMENTS[0])
+        db.session.commit = lambda: writes.append(lock.held)
+        try:
+            crawler.save_or_update_devices([], {"monthlyFeeGross": "50,00"})
+            crawler.save_price_history()
+            crawler.mark_inactive_offers()
+        finally:
+            parallel._write_lock = None
+            del db.session.commit
+        self.assertEqual(lock.acquired, 3)
+        self.assertTrue(writes)
+        self.assertTrue(all(writes))
@@ -0,0 +1,46 @@
+import threading
+import unittest
+
+from crawler.pipeline import crawl_pipeline
+
+
+class StubCrawler:
+    """Upstream of 2 contract conditions x 3 offers x 4 pages"""
+    frontier = None
+
+    def __init__(self, failing_page=None):
+        self.failing_page = failing_page
+        self.saved = []
+        self.saving_threads = set()
+
+    def available_contract_conditions(self):
+        return ['24A', '12A']
+
+    def iter_offers(self, contract_conditions):
+        for contract_condition in contract_conditions:
+            for i in range(3):
+                yield {'offerNSICode': '%s-%d' % (contract_condition, i)}
+
+    def iter_device_pages(self, offer):
+        for page in range(1, 5):
+            if page == self.failing_page:
+                raise ValueError('upstream error')
+            yield page, [{'sku': '%s-%d' % (offer['offerNSICode'], page)}]
+
+    def save_or_update_devices(self, devices, offer):
+        self.saving_threads.add(threading.current_thread())
+        self.saved.extend(device['sku'] for device in devices)
+
+
+class PipelineTestCase(unittest.TestCase):
+    def test_saves_every_page_in_calling_thread(self):
+        crawler = StubCrawler()
+        saved_pages = crawl_pipeline(crawler, fetch_workers=3, queue_size=2)
+        self.assertEqual(saved_pages, 24)
+        self.assertEqual(len(set(crawler.saved)), 24)
+        self.assertEqual(crawler.saving_threads, {threading.current_thread()})
+
+    def test_fetch_errors_are_raised(self):
+        crawler = StubCrawler(failing_page=3)
+        with self.assertRaises(ValueError):
+            crawl_pipeline(crawler, fetch_workers=2, queue_size=2)
@@ -0,0 +1,73 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import requests
+
+from config import Config
+from crawler.ratelimit import AdaptiveRateLimiter
+from crawler.replay import Cassette, RecordingTransport, ReplayServer
+from crawler.web_crawler import WebCrawler
+
+OFFER = {
+    "offerNSICode": "NSZAS24A",
+    "tariffPlanCode": "5F20A",
+    "contractConditionCode": "24A"
+}
+PRODUCT_PAGE = "http://plus.pl/telefon?deviceTypeCode=PHONE&" \
+               "deviceStockCode=lg-g2-mini-lte-black&offerNSICode=NSZAS24A"
+
+
+class ReplayTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cassette = Cassette(os.path.join(self.directory, 'plus.json'))
+        data = dict(OFFER, processSegmentation="IND.NEW.POSTPAID.MNP",
+                    page=1)
+        self.cassette.record('POST', Config.DEVICE_LIST, data, 200,
+                             b'{"pageInfo": {"pages": 1}, "devices": []}')
+        self.cassette.record('GET', PRODUCT_PAGE, None, 200, b'<html/>')
+        self.cassette.save()
+        self.limiter = AdaptiveRateLimiter(rate=20.0)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def replay(self, **kwargs):
+        server = ReplayServer(Cassette(self.cassette.path), **kwargs).start()
+        self.addCleanup(server.stop)
+        return server
+
+    def test_crawler_runs_against_replayed_cassette(self):
+        server = self.replay()
+        crawler = WebCrawler(segment="IND.NEW.POSTPAID.MNP",
+                             transport=server.transport(limiter=self.limiter))
+        pages = list(crawler.iter_device_pages(OFFER))
+        self.assertEqual(pages, [(1, [])])
+        other_offer = PRODUCT_PAGE.replace('NSZAS24A', 'NSZAS12A')
+        self.assertEqual(crawler._get(other_offer).content, b'<html/>')
+        self.assertEqual(server.misses, 0)
+
+    def test_recorded_exchanges_match_regardless_of_host(self):
+        server = self.replay()
+        recorded = Cassette(os.path.join(self.directory, 'again.json'))
+        transport = RecordingTransport(recorded, limiter=self.limiter)
+        transport.get(PRODUCT_PAGE.replace('plus.pl', server.netloc))
+        self.assertEqual(recorded.play('GET', PRODUCT_PAGE, None),
+                         (200, b'<html/>'))
+
+    def test_injected_errors_are_retried(self):
+        server = self.replay(error_rate=1.0)
+        transport = server.transport(retries=1, backoff=0.01,
+                                     limiter=self.limiter)
+        with self.assertRaises(requests.HTTPError):
+            transport.get(PRODUCT_PAGE)
+        self.assertEqual(transport.summary()['PRODUCT_PAGE']['failures'], 2)
+
+        server = self.replay()
+        with self.assertRaises(requests.HTTPError):
+            server.transport(retries=0, limiter=self.limiter).get(
+                "http://plus.pl/telefon?deviceStockCode=unknown").\
+                raise_for_status()
+        self.assertEqual(server.misses, 1)
@@ -0,0 +1,167 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from app import create_app, db
+from app.models import Offer, SKU
+from crawler.scheduler import CrawlScheduler, combo_key
+from crawler.workqueue import QueueCrawler
+from tests.test_crawler import StubTransport
+
+
+class StubCrawler:
+    """
+    Two offers of one page each; devices of HOT change on every refresh,
+    devices of COLD never do
+    """
+    HOT = {"contractConditionCode": "24A", "tariffPlanCode": "T1",
+           "offerNSICode": "HOT"}
+    COLD = {"contractConditionCode": "24A", "tariffPlanCode": "T1",
+            "offerNSICode": "COLD"}
+
+    def __init__(self, segment, refreshed):
+        self.segment = segment
+        self.refreshed = refreshed
+        self.request_counter = 0
+        self.unchanged_devices = 0
+        self.scrapping_time = None
+
+    def available_contract_conditions(self):
+        self.request_counter += 1
+        return ["24A"]
+
+    def offer_list(self, contract_conditions):
+        self.request_counter += 1
+        return [self.HOT, self.COLD]
+
+    def iter_device_pages(self, offer):
+        self.request_counter += 1
+        yield 1, [{"sku": "sku"}]
+
+    def save_or_update_devices(self, devices, offer):
+        self.refreshed.append(offer["offerNSICode"])
+        if offer is self.COLD:
+            self.unchanged_devices += len(devices)
+
+    def save_price_history(self, offer_info=None):
+        pass
+
+    def mark_inactive_offers(self, offer_info=None):
+        pass
+
+
+class CrawlSchedulerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.directory = tempfile.mkdtemp()
+        self.now = 0.0
+        self.refreshed = []
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def scheduler(self, budget=1000, crawler_factory=None):
+        return CrawlScheduler(
+            ["IND.NEW.POSTPAID.ACQ"], budget=budget, min_interval=60,
+            max_interval=3600, discovery_interval=24 * 3600,
+            state_path=os.path.join(self.directory, 'scheduler.json'),
+            crawler_factory=crawler_factory or (
+                lambda segment: StubCrawler(segment, self.refreshed)),
+            clock=lambda: self.now
+        )
+
+    def test_volatile_offers_are_refreshed_more_often(self):
+        scheduler = self.scheduler()
+        for minute in range(6 * 60):
+            self.now = minute * 60.0
+            scheduler.run_once()
+        hot, cold = self.refreshed.count("HOT"), self.refreshed.count("COLD")
+        self.assertGreater(hot, 5 * cold)
+        self.assertGreaterEqual(cold, 5)
+        cold_key = combo_key("IND.NEW.POSTPAID.ACQ", StubCrawler.COLD)
+        self.assertLess(scheduler.combos[cold_key]['volatility'], 0.05)
+
+        restarted = self.scheduler()
+        self.assertEqual(restarted.combos[cold_key]['volatility'],
+                         scheduler.combos[cold_key]['volatility'])
+
+    def test_requests_stay_within_hourly_budget(self):
+        scheduler = self.scheduler(budget=10)
+        for minute in range(60):
+            self.now = minute * 60.0
+            scheduler.run_once()
+        self.assertLessEqual(scheduler.requests_last_hour(self.now), 10)
+        # 2 requests of offer discovery, the rest are single page refreshes
+        self.assertEqual(len(self.refreshed), 8)
+
+    def test_refresh_sees_offers_saved_by_other_processes(self):
+        scheduler = self.scheduler(crawler_factory=lambda segment: (
+            QueueCrawler(segment, transport=StubTransport(),
+                         incremental=True)))
+        for tariff in ("T1", "T2"):
+            offer = dict(StubCrawler.HOT, tariffPlanCode=tariff,
+                         monthlyFeeGross="100,00")
+            scheduler.combos[combo_key("IND.NEW.POSTPAID.ACQ", offer)] = {
+                'segment': "IND.NEW.POSTPAID.ACQ", 'volatility': 1.0,
+                'refreshed_at': 0, 'pages': 1, 'offer': offer
+            }
+        first, second = sorted(scheduler.combos)
+        scheduler.refresh(first, 60.0)
+        # a crawl running meanwhile saved an offer of the other tariff
+        saved = Offer.query.first()
+        db.session.add(Offer(
+            segmentation=saved.segmentation, market=saved.market,
+            sku=SKU.query.filter_by(stock_code="sku-1").one(),
+            offer_code=saved.offer_code, tariff_plan_code="T2",
+            contract_condition_code=saved.contract_condition_code
+        ))
+        db.session.commit()
+        scheduler.refresh(second, 120.0)
+        self.assertEqual(Offer.query.count(), 6)
+        self.assertEqual(
+            Offer.query.filter_by(tariff_plan_code="T2",
+                                  is_active=True).count(), 3)
+
+    def test_offers_no_longer_listed_are_deactivated(self):
+        listed = [dict(StubCrawler.HOT, tariffPlanCode=tariff,
+                       monthlyFeeGross="100,00") for tariff in ("T1", "T2")]
+
+        def crawler_factory(segment):
+            crawler = QueueCrawler(segment, transport=StubTransport(),
+                                   incremental=True)
+            crawler.available_contract_conditions = lambda: ["24A"]
+            crawler.offer_list = lambda contract_conditions: list(listed)
+            return crawler
+
+        def active(tariff):
+            return {offer.sku.stock_code for offer in Offer.query.filter_by(
+                tariff_plan_code=tariff, is_active=True)}
+
+        scheduler = self.scheduler(crawler_factory=crawler_factory)
+        scheduler.run_once()
+        self.now = 60.0
+        self.assertEqual(scheduler.run_once(), 2)
+        self.assertEqual(active("T2"), {"sku-1", "sku-2", "sku-3"})
+
+        # T1 no longer lists a device a crawl saved before
+        saved = Offer.query.filter_by(tariff_plan_code="T1").first()
+        db.session.add(Offer(
+            segmentation=saved.segmentation, market=saved.market,
+            sku=SKU(stock_code="sku-9", base_product=saved.sku.base_product),
+            offer_code=saved.offer_code, tariff_plan_code="T1",
+            contract_condition_code=saved.contract_condition_code
+        ))
+        db.session.commit()
+        # and T2 is no longer listed at all
+        listed.pop()
+        self.now = 24 * 3600.0
+        scheduler.run_once()
+        self.assertEqual(active("T1"), {"sku-1", "sku-2", "sku-3"})
+        self.assertEqual(active("T2"), set())
@@ -0,0 +1,46 @@
+import json
+import unittest
+
+from crawler.streaming import JSONObjectStream, slim_device
+from tests.test_crawler import stub_device
+
+
+def chunked(content, size):
+    return [content[start:start + size]
+            for start in range(0, len(content), size)]
+
+
+class JSONObjectStreamTestCase(unittest.TestCase):
+    PAGE = {
+        "pageInfo": {"pages": 12, "availableContractConditions": []},
+        "rotator": [],
+        "devices": [stub_device("lg-g2-mini-lte-%d" % i) for i in range(5)],
+        "promoText": "Żółty telefon za 1 zł",
+        "total": 123456789
+    }
+
+    def test_items_and_members_match_whole_document_decoding(self):
+        content = json.dumps(self.PAGE, ensure_ascii=False,
+                             indent=1).encode('utf-8')
+        for size in (1, 3, 64, len(content)):
+            stream = JSONObjectStream(chunked(content, size))
+            devices = [device for key, device in stream if key == 'devices']
+            self.assertEqual(devices, self.PAGE["devices"])
+            self.assertEqual(stream.members, {
+                "pageInfo": self.PAGE["pageInfo"],
+                "promoText": self.PAGE["promoText"],
+                "total": self.PAGE["total"]
+            })
+
+    def test_truncated_body_is_an_error(self):
+        content = json.dumps(self.PAGE).encode('utf-8')
+        with self.assertRaises(ValueError):
+            list(JSONObjectStream(chunked(content[:-40], 16)))
+
+    def test_slim_device_keeps_only_fields_saving_reads(self):
+        device = slim_device(stub_device("lg-g2-mini-lte-black"))
+        self.assertNotIn("deviceName", device)
+        self.assertEqual(device["prices"], {"grossPrice": "99,00"})
+        self.assertEqual(device["imagesOnDetails"],
+                         [{"normalImage": "http://photo.com/1.jpg",
+                           "defaultImage": True}])
@@ -0,0 +1,152 @@
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import requests
+
+from crawler.ratelimit import AdaptiveRateLimiter, EndpointLimiter
+from crawler.transport import Transport
+
+
+class FlakyHandler(BaseHTTPRequestHandler):
+    """Answers 503 until `failures` runs out, then 200"""
+    failures = 0
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if FlakyHandler.failures > 0:
+            FlakyHandler.failures -= 1
+            self.send_response(503)
+            body = b'{}'
+        else:
+            self.send_response(200)
+            body = b'{"ok": true}'
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StallHandler(BaseHTTPRequestHandler):
+    """
+    Sends bodies in chunks, without Content-Length; the first `stalls`
+    ones stall after their first chunk
+    """
+    protocol_version = 'HTTP/1.1'
+    stalls = 0
+    body = b'{"devices": [1, 2, 3], "pageInfo": {"pages": 1}}'
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        stall = StallHandler.stalls > 0
+        StallHandler.stalls -= 1
+        self.send_response(200)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for start in range(0, len(self.body), 16):
+            chunk = self.body[start:start + 16]
+            self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+            self.wfile.flush()
+            if stall:
+                time.sleep(0.5)
+                self.close_connection = True
+                return
+        self.wfile.write(b'0\r\n\r\n')
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    # keep-alive connections are served until their client closes them
+    daemon_threads = True
+
+
+class TransportTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = Server(('127.0.0.1', 0), FlakyHandler)
+        self.url = 'http://127.0.0.1:%d/' % self.server.server_port
+        threading.Thread(target=self.server.serve_forever,
+                         daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_retries_transient_errors(self):
+        FlakyHandler.failures = 2
+        transport = Transport(retries=3, backoff=0.01,
+                              limiter=AdaptiveRateLimiter())
+        r = transport.post(self.url, data={'a': 1})
+        self.assertEqual(r.json(), {'ok': True})
+        stats = transport.summary()['PRODUCT_PAGE']
+        self.assertEqual(stats['requests'], 3)
+        self.assertEqual(stats['retries'], 2)
+        self.assertEqual(stats['failures'], 2)
+        self.assertLess(stats['rate'], 5.0)
+
+    def test_gives_up_after_retries(self):
+        FlakyHandler.failures = 5
+        transport = Transport(retries=1, backoff=0.01,
+                              limiter=AdaptiveRateLimiter())
+        with self.assertRaises(requests.HTTPError):
+            transport.post(self.url, data={'a': 1})
+        self.assertEqual(transport.summary()['PRODUCT_PAGE']['requests'], 2)
+
+
+
+class StreamingTransportTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = Server(('127.0.0.1', 0), StallHandler)
+        self.url = 'http://127.0.0.1:%d/' % self.server.server_port
+        threading.Thread(target=self.server.serve_forever,
+                         daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_reading_streamed_body_is_retried_and_counted(self):
+        StallHandler.stalls = 1
+        transport = Transport(timeout=0.2, retries=2, backoff=0.01,
+                              limiter=AdaptiveRateLimiter())
+        decoded = transport.post(self.url, data={'a': 1},
+                                 decode=lambda chunks: b''.join(chunks))
+        self.assertEqual(decoded, StallHandler.body)
+        stats = transport.summary()['PRODUCT_PAGE']
+        self.assertEqual((stats['requests'], stats['failures']), (2, 1))
+        self.assertEqual(stats['bytes'], len(StallHandler.body))
+
+
+class EndpointLimiterTestCase(unittest.TestCase):
+    def test_rate_grows_up_to_ceiling_while_healthy(self):
+        limiter = EndpointLimiter(ceiling=8.0, rate=2.0)
+        for _ in range(100):
+            limiter.record(0.1, healthy=True)
+        self.assertEqual(limiter.rate, 8.0)
+
+    def test_rate_backs_off_on_errors_and_rising_latency(self):
+        limiter = EndpointLimiter(ceiling=8.0, rate=8.0, floor=1.0)
+        limiter.record(0.1, healthy=False)
+        self.assertEqual(limiter.rate, 4.0)
+        # second cut waits for cooldown
+        limiter.record(0.1, healthy=False)
+        self.assertEqual(limiter.rate, 4.0)
+
+        limiter = EndpointLimiter(ceiling=8.0, rate=8.0)
+        limiter.record(0.1, healthy=True)
+        for _ in range(10):
+            limiter.record(1.0, healthy=True)
+        self.assertEqual(limiter.rate, 4.0)
+
+    def test_acquire_spaces_requests_by_rate(self):
+        limiter = EndpointLimiter(ceiling=20.0, rate=20.0)
+        limiter.tokens = 0
+        start = time.time()
+        for _ in range(4):
+            limiter.acquire()
+        self.assertGreaterEqual(time.time() - start, 0.15)
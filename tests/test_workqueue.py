@@ -0,0 +1,171 @@
+import datetime
+import unittest
+
+from app import create_app, db
+from app.models import CrawlUnit, Offer, Product, SKU
+from crawler.web_crawler import WebCrawler
+from crawler.workqueue import (CrawlWorker, WorkQueue, _Heartbeat,
+                               enqueue_crawl, enqueue_discovery, DONE,
+                               FAILED, LEASED, PENDING)
+from tests.test_crawler import ProductPageStubTransport
+
+
+class StubCrawler:
+    """One offer of 3 pages with no devices"""
+    OFFER = {"contractConditionCode": "24A", "tariffPlanCode": "5F20A",
+             "offerNSICode": "NSZAS24A"}
+
+    def __init__(self, segment):
+        self.segment = segment
+        self.saved_pages = []
+        self.recorded_offers = []
+        self.finalized = []
+
+    def available_contract_conditions(self):
+        return ["24A"]
+
+    def offer_list(self, contract_conditions):
+        return [self.OFFER]
+
+    def _device_page(self, offer, page):
+        return {"pageInfo": {"pages": 3}, "devices": []}
+
+    def save_or_update_devices(self, devices, offer, commit=True):
+        self.saved_pages.append(offer)
+
+    def save_price_history(self, offer_info=None, commit=True):
+        self.recorded_offers.append(offer_info)
+
+    def mark_inactive_offers(self):
+        self.finalized.append(len(self.saved_pages))
+
+
+class FlakyQueue:
+    """Queue whose first heartbeat fails"""
+    lease_seconds = 0.03
+
+    def __init__(self):
+        self.beats = 0
+
+    def heartbeat(self, unit_ids, engine=None):
+        self.beats += 1
+        if self.beats == 1:
+            raise RuntimeError('database is locked')
+
+
+class WorkQueueTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def expire_leases(self):
+        CrawlUnit.query.update({CrawlUnit.lease_expires:
+                                datetime.datetime(2000, 1, 1)})
+        db.session.commit()
+
+    def test_units_are_leased_once_and_reissued_after_expiry(self):
+        enqueue_crawl(["IND.NEW.POSTPAID.ACQ", "IND.NEW.POSTPAID.MNP"])
+        first, second = WorkQueue('first'), WorkQueue('second')
+        leased = first.lease(limit=1)
+        self.assertEqual(len(leased), 1)
+        self.assertEqual([unit.id for unit in second.lease()],
+                         [unit.id + 1 for unit in leased])
+        self.assertEqual(second.lease(), [])
+        self.assertEqual(first.heartbeat([leased[0].id]), 1)
+
+        # first worker died
+        self.expire_leases()
+        reissued = second.lease(limit=1)
+        self.assertEqual([unit.id for unit in reissued],
+                         [unit.id for unit in leased])
+        self.assertEqual(reissued[0].attempts, 2)
+        self.assertFalse(first.finish(leased[0]))
+        self.assertTrue(second.finish(reissued[0]))
+        db.session.commit()
+        self.assertEqual(WorkQueue.counts(), {DONE: 1, LEASED: 1})
+
+    def test_units_are_given_up_after_max_attempts(self):
+        enqueue_crawl(["IND.NEW.POSTPAID.ACQ"])
+        queue = WorkQueue('worker', max_attempts=2)
+        queue.fail(queue.lease()[0])
+        self.assertEqual(WorkQueue.counts(), {PENDING: 1})
+        queue.lease()
+        self.expire_leases()
+        self.assertEqual(queue.lease(), [])
+        self.assertEqual(WorkQueue.counts(), {FAILED: 1})
+
+    def test_worker_queues_and_saves_every_page(self):
+        enqueue_crawl(["IND.NEW.POSTPAID.ACQ"])
+        crawlers = {}
+
+        def crawler_factory(segment):
+            crawlers[segment] = StubCrawler(segment)
+            return crawlers[segment]
+
+        worker = CrawlWorker(WorkQueue('worker'), crawler_factory, poll=0.01)
+        worker.run(exit_when_idle=True)
+        self.assertEqual((worker.processed, worker.failed), (5, 0))
+        crawler = crawlers["IND.NEW.POSTPAID.ACQ"]
+        self.assertEqual(len(crawler.saved_pages), 3)
+        self.assertEqual(crawler.recorded_offers, [StubCrawler.OFFER] * 3)
+        # finalized once, after every page was saved
+        self.assertEqual(crawler.finalized, [3])
+        self.assertEqual(WorkQueue.counts(), {DONE: 5})
+
+    def test_finalize_waits_for_pages_of_its_segment(self):
+        enqueue_crawl(["IND.NEW.POSTPAID.ACQ"])
+        worker = CrawlWorker(WorkQueue('worker'), StubCrawler)
+        worker.process(worker.queue.lease(limit=1)[0])
+        pages = worker.queue.lease()
+        self.assertEqual([unit.kind for unit in pages], ['page'])
+        self.assertEqual(worker.queue.lease(), [])
+        worker.process(pages[0])
+        self.assertEqual({unit.kind for unit in worker.queue.lease()},
+                         {'page'})
+        self.expire_leases()
+        # pages leased again, so still not finished
+        self.assertEqual({unit.kind for unit in worker.queue.lease()},
+                         {'page'})
+
+    def test_heartbeat_survives_errors(self):
+        queue = FlakyQueue()
+        heartbeat = _Heartbeat(queue, db.engine)
+        heartbeat.unit_ids = frozenset([1])
+        heartbeat.start()
+        heartbeat.stopped.wait(0.2)
+        heartbeat.stopped.set()
+        heartbeat.join()
+        self.assertGreater(queue.beats, 1)
+
+    def test_discovery_is_saved_only_with_its_unit_done(self):
+        product = Product(manufacturer="LG", model_name="G2 Mini",
+                          product_type="PHONE")
+        sku = SKU(base_product=product, stock_code="lg-g2-mini-lte-black")
+        offer = Offer(segmentation="IND.NEW.POSTPAID.ACQ", sku=sku,
+                      market="IND", offer_code="NSZAS24A",
+                      tariff_plan_code="5F20A", contract_condition_code="24A")
+        db.session.add_all([product, sku, offer])
+        db.session.commit()
+        self.assertEqual(enqueue_discovery(), 1)
+
+        def crawler_factory(segment):
+            return WebCrawler(segment, transport=ProductPageStubTransport())
+
+        first = CrawlWorker(WorkQueue('first'), crawler_factory)
+        unit = first.queue.lease()[0]
+        # first worker stalled and its unit was leased again
+        self.expire_leases()
+        second = CrawlWorker(WorkQueue('second'), crawler_factory)
+        reissued = second.queue.lease()[0]
+        first.process(unit)
+        self.assertEqual(SKU.query.count(), 1)
+        second.process(reissued)
+        self.assertEqual(SKU.query.count(), 2)
+        self.assertEqual(WorkQueue.counts(), {DONE: 1})